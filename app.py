@@ -8,17 +8,19 @@ from modules.common_ui import show_table, show_graph
 
 from modules.summary.ui import summary_inputs
 from modules.summary.server import (update_filename_input, load_data_frame, update_aggregator_input,
-                                    update_graph_input, load_summary_data, create_graph, filter_df)
+                                    update_graph_input, load_summary_data, create_graph, filter_df,
+                                    export_summary)
 
 from modules.distributions.ui import distribution_selection, create_dist_settings
 from modules.distributions.server import (update_dist_prob, update_plot_prop,
                                           update_dist_min_max, create_dist_df, update_dist_prop_select,
-                                          create_dist_details, dist_graph)  # dist_eq
+                                          create_dist_details, dist_graph, export_dist_df)  # dist_eq
 
+from modules.statistics.ui import testing_inputs
+from modules.statistics.server import update_testing_inputs, run_tests
 
-# TODO Check import management
-#   if there are some imports, such as numpy, that are used only in certain functions, import the library inside that
-#   function. This way the global namespace is less cluttered.
+from utils import start_warm_up
+from memory import get_memory_budget
 
 app_width = Config.ui_config('width')
 app_height = Config.ui_config('height')
@@ -74,16 +76,35 @@ app_ui = x.ui.page_fillable(
                 ),
                 height=app_height
             )
+        ),
+        ui.nav(
+            'Statistical Testing',
+            x.ui.layout_sidebar(
+                x.ui.sidebar(
+                    {'class': 'p-3'},
+                    testing_inputs(statistics_id),
+                    width=app_width
+                ),
+                x.ui.layout_column_wrap(
+                    1,
+                    show_table(statistics_id),
+                ),
+                height=app_height
+            )
         )
     )
 )
 
 
 def server(input: Inputs, output: Outputs, session: Session):
-    orig_summary_df = reactive.Value()
+    # The large per-session state is held against the memory budget, which may evict it while the session is idle
+    budget = get_memory_budget()
+
+    data_source = reactive.Value()
+    orig_summary_df = budget.value(session, 'orig_summary_df')
     grouper = reactive.Value()
-    summary_df = reactive.Value()
-    dist_data = reactive.Value()
+    summary_df = budget.value(session, 'summary_df')
+    dist_data = budget.value(session, 'dist_data')
 
     # Distributions Section ####
     @output
@@ -94,7 +115,10 @@ def server(input: Inputs, output: Outputs, session: Session):
     @output
     @render.ui
     def distribution_details():
-        create_dist_details(dist_id, dist_data()['stats'])
+        dist = dist_data()
+        # Multivariate samples have no univariate statistics to bootstrap
+        sample = dist['distribution_array'][0] if dist['parameters'] is not None else None
+        create_dist_details(dist_id, dist['stats'], sample, dist['parameters'], dist['random_state'])
 
     # @output
     # @render.ui
@@ -113,19 +137,34 @@ def server(input: Inputs, output: Outputs, session: Session):
 
     dist_graph(dist_id, dist_data)
 
+    export_dist_df(dist_id, dist_data)
+
     # Summary Section ####
 
     update_filename_input(summary_id)
 
-    load_data_frame(summary_id, grouper, orig_summary_df)
+    load_data_frame(summary_id, grouper, data_source)
 
     update_aggregator_input(summary_id, grouper)
 
-    update_graph_input(summary_id, grouper)
+    update_graph_input(summary_id, grouper, summary_df)
+
+    load_summary_data(summary_id, data_source, orig_summary_df, summary_df)
 
-    load_summary_data(summary_id, orig_summary_df, summary_df)
+    filtered_df = filter_df(summary_id, data_source, summary_df)
 
-    create_graph(summary_id, filter_df(summary_id, orig_summary_df, summary_df))
+    create_graph(summary_id, filtered_df)
+
+    export_summary(summary_id, summary_df, filtered_df)
+
+    # Statistical Testing Section ####
+
+    update_testing_inputs(statistics_id, grouper)
+
+    run_tests(statistics_id, data_source)
 
 
 app = App(app_ui, server, debug=False)
+
+if Config.server_config('warm_up'):
+    start_warm_up()
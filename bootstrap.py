@@ -0,0 +1,157 @@
+"""
+Vectorised bootstrap confidence intervals.
+
+Resamples are never drawn one at a time: a chunk of B resamples is either a single (B, n) array of indices into the
+sample, or a (B, n) array of Poisson(1) weights (the Poisson bootstrap, which also works on many groups at once), and
+every statistic is computed for the whole chunk with array reductions. Chunks are sized to bound memory and can be
+fanned out over worker processes for large numbers of resamples. Every chunk gets its own seed spawned from
+`random_state`, so results do not depend on the number of workers.
+"""
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Maximum number of elements of a (resamples, observations) chunk
+CHUNK_SIZE = 4_000_000
+
+# Closed form maximum likelihood loc and scale, matching scipy.stats' `fit`, of the distributions that have one
+fit_functions = {
+    'norm': lambda s: (s['mean'], s['std']),
+    'expon': lambda s: (s['min'], s['mean'] - s['min']),
+    'uniform': lambda s: (s['min'], s['max'] - s['min'])
+}
+
+
+def bootstrap_stats(sample: np.ndarray, dist_name: str = None, resamples: int = 1000, confidence: float = 0.1,
+                    method: str = 'index', workers: int = 1, random_state: int = None) -> dict[str, tuple]:
+    """
+    Bootstrap percentile intervals of the mean, variance, skewness and kurtosis of a sample and, for distributions
+    with a closed form fit, of the fitted loc and scale
+    :param sample: 1-D sample
+    :param dist_name: scipy.stats name of the distribution the sample was drawn from
+    :param resamples: number of bootstrap resamples
+    :param confidence: significance level, a value of 0.1 gives 90% intervals
+    :param method: 'index' to resample with replacement, 'poisson' to weight the observations with Poisson(1) weights
+    :param workers: number of worker processes the chunks are spread over
+    :param random_state: seed of the resampling
+    :return: {statistic name: (lower bound, upper bound)}
+    """
+    import numpy as np
+
+    sample = np.asarray(sample, dtype=np.float64)
+    chunk = max(1, CHUNK_SIZE // max(len(sample), 1))
+    sizes = [min(chunk, resamples - start) for start in range(0, resamples, chunk)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_resample_stats, [sample] * len(sizes), sizes, seeds, [method] * len(sizes)))
+    else:
+        parts = [_resample_stats(sample, size, seed, method) for size, seed in zip(sizes, seeds)]
+
+    stats = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    if dist_name in fit_functions:
+        stats['loc'], stats['scale'] = fit_functions[dist_name](stats)
+
+    bounds = [100 * confidence / 2, 100 * (1 - confidence / 2)]
+
+    return {name: tuple(np.percentile(stats[name], bounds))
+            for name in ['mean', 'variance', 'skewness', 'kurtosis', 'loc', 'scale'] if name in stats}
+
+
+def _resample_stats(sample, size, seed, method):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n = len(sample)
+
+    if method == 'index':
+        resampled = sample[rng.integers(0, n, size=(size, n))]
+        weights, total = None, n
+    elif method == 'poisson':
+        resampled = np.broadcast_to(sample, (size, n))
+        weights = rng.poisson(1, size=(size, n)).astype(np.float64)
+        total = weights.sum(axis=1)
+    else:
+        raise ValueError(f'"{method}" is not a supported bootstrap method')
+
+    def weighted_sum(values):
+        return values.sum(axis=1) if weights is None else (values * weights).sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = weighted_sum(resampled) / total
+        deviation = resampled - mean[:, None]
+        squared = deviation * deviation
+        m2 = weighted_sum(squared) / total
+        m3 = weighted_sum(squared * deviation) / total
+        m4 = weighted_sum(squared * squared) / total
+
+        stats = {
+            'mean': mean,
+            'variance': m2 * total / (total - 1),
+            'std': np.sqrt(m2),
+            # Biased estimators, same as scipy.stats.skew and scipy.stats.kurtosis (Fisher)
+            'skewness': m3 / m2 ** 1.5,
+            'kurtosis': m4 / m2 ** 2 - 3
+        }
+
+    if weights is None:
+        stats['min'], stats['max'] = resampled.min(axis=1), resampled.max(axis=1)
+    else:
+        # Observations with a weight of 0 are not part of the resample
+        stats['min'] = np.where(weights > 0, resampled, np.inf).min(axis=1)
+        stats['max'] = np.where(weights > 0, resampled, -np.inf).max(axis=1)
+
+    return stats
+
+
+def bootstrap_group_means(data_frame: pd.DataFrame, group_by: str, columns: list[str] | tuple[str],
+                          resamples: int = 1000, confidence: float = 0.1, random_state: int = None) -> pd.DataFrame:
+    """
+    Poisson bootstrap percentile intervals of the mean of every group. Each chunk of resamples is a single
+    (resamples, rows) weight array, reduced per group with one `np.add.reduceat` per column.
+    :param data_frame: DataFrame to summarize
+    :param group_by: column to group by
+    :param columns: numeric columns
+    :param resamples: number of bootstrap resamples
+    :param confidence: significance level, a value of 0.1 gives 90% intervals
+    :param random_state: seed of the resampling
+    :return: one row per group with `<column>_mean_ci_low` and `<column>_mean_ci_high` columns
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, groups = pd.factorize(data_frame[group_by], sort=True)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    values = {col: data_frame[col].to_numpy(dtype=np.float64)[order] for col in columns}
+
+    n = len(order)
+    chunk = max(1, CHUNK_SIZE // max(n, 1))
+    seeds = np.random.SeedSequence(random_state).spawn(-(-resamples // chunk))
+    means = {col: [] for col in columns}
+
+    for start, seed in zip(range(0, resamples, chunk), seeds):
+        weights = np.random.default_rng(seed).poisson(1, size=(min(chunk, resamples - start), n)).astype(np.float64)
+        totals = np.add.reduceat(weights, starts, axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for col in columns:
+                means[col].append(np.add.reduceat(weights * values[col], starts, axis=1) / totals)
+
+    result = pd.DataFrame({group_by: groups})
+    bounds = [100 * confidence / 2, 100 * (1 - confidence / 2)]
+
+    for col in columns:
+        # Resamples in which a group got no weight at all carry no information about it
+        low, high = np.nanpercentile(np.concatenate(means[col]), bounds, axis=0)
+        result[f'{col}_mean_ci_low'] = low
+        result[f'{col}_mean_ci_high'] = high
+
+    return result
@@ -0,0 +1,253 @@
+"""
+Persistent result cache shared by all workers, surviving restarts and deploys.
+
+Results are pickled into a single SQLite database, keyed by a hash of the inputs that produced them and of
+`CACHE_VERSION`. Whenever the shape of a cached result changes, `CACHE_VERSION` is bumped, so that results pickled by
+older code are never served; they are no longer read and age out of the cache like any other. SQLite's own
+file locking makes concurrent use from several worker processes safe, and write-ahead logging lets readers carry on
+while another process writes. Once the stored results exceed the byte budget, the least recently used ones are
+evicted.
+
+The cache can be inspected and cleared from the command line:
+
+    python cache.py info
+    python cache.py list [--kind summary]
+    python cache.py clear [--kind distribution]
+"""
+from __future__ import annotations
+
+import os
+import time
+import pickle
+import hashlib
+import logging
+import sqlite3
+import argparse
+import threading
+from typing import Any, Callable
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+# Bump whenever a cached result changes shape, e.g. gains a field
+CACHE_VERSION = 2
+
+
+class DiskCache:
+    """
+    Least recently used cache of pickled results in an SQLite database
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._connection() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+                        'value BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+            con.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads, so every thread opens its own
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.con = con
+
+        return con
+
+    @staticmethod
+    def key(kind: str, *parts) -> str:
+        """
+        Build a cache key from the kind of result and the inputs it was computed from
+        :param kind: kind of result e.g. 'summary', also used by `clear` and `entries`
+        :param parts: inputs of the computation, DataFrames are hashed by content
+        :return:
+        """
+        digest = hashlib.sha256(f'v{CACHE_VERSION}\0'.encode())
+        for part in parts:
+            digest.update(fingerprint(part).encode())
+            digest.update(b'\0')
+
+        return f'{kind}:{digest.hexdigest()}'
+
+    def get(self, key: str, default=None):
+        """
+        Return the result stored under `key`, or `default` if there is none
+        :param key: key built with `key`
+        :param default: value returned on a cache miss
+        :return:
+        """
+        try:
+            con = self._connection()
+            row = con.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return default
+
+            con.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+
+            return pickle.loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError):
+            logger.warning('Could not read "%s" from the result cache', key, exc_info=True)
+            return default
+
+    def set(self, key: str, value) -> bool:
+        """
+        Store `value` under `key`, then evict the least recently used results until the cache fits its byte budget
+        :param key: key built with `key`
+        :param value: any picklable result
+        :return: whether the result was stored
+        """
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return False
+
+        now = time.time()
+        try:
+            con = self._connection()
+            # IMMEDIATE takes the database write lock up front, so the insert and the eviction are atomic across
+            # processes
+            con.execute('BEGIN IMMEDIATE')
+            try:
+                con.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, key.split(':', 1)[0], blob, len(blob), now, now))
+                con.execute('DELETE FROM results WHERE key IN (SELECT key FROM (SELECT key, SUM(size) OVER '
+                            '(ORDER BY accessed DESC, key) AS total FROM results) WHERE total > ?)',
+                            (self.max_bytes,))
+                con.execute('COMMIT')
+            except BaseException:
+                con.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            logger.warning('Could not write "%s" to the result cache', key, exc_info=True)
+            return False
+
+        return True
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]):
+        """
+        Return the result stored under `key`, computing and storing it first on a cache miss
+        :param key: key built with `key`
+        :param compute: function without arguments returning the result
+        :return:
+        """
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute()
+            self.set(key, value)
+
+        return value
+
+    def delete(self, key: str):
+        """
+        Remove the result stored under `key`, if any
+        :param key: key built with `key`
+        :return:
+        """
+        try:
+            self._connection().execute('DELETE FROM results WHERE key = ?', (key,))
+        except sqlite3.Error:
+            logger.warning('Could not delete "%s" from the result cache', key, exc_info=True)
+
+    def entries(self, kind: str = None) -> list[tuple[str, int, float, float]]:
+        """
+        List the cached results, most recently used first
+        :param kind: only list results of this kind
+        :return: list of (key, size in bytes, created, accessed)
+        """
+        query = 'SELECT key, size, created, accessed FROM results'
+        if kind is not None:
+            return self._connection().execute(f'{query} WHERE kind = ? ORDER BY accessed DESC', (kind,)).fetchall()
+
+        return self._connection().execute(f'{query} ORDER BY accessed DESC').fetchall()
+
+    def clear(self, kind: str = None) -> int:
+        """
+        Remove all cached results, or only those of one kind
+        :param kind: only remove results of this kind
+        :return: number of removed results
+        """
+        con = self._connection()
+        if kind is None:
+            removed = con.execute('DELETE FROM results').rowcount
+        else:
+            removed = con.execute('DELETE FROM results WHERE kind = ?', (kind,)).rowcount
+
+        con.execute('VACUUM')
+
+        return removed
+
+
+def fingerprint(value) -> str:
+    """
+    Return a string that identifies `value` by content. DataFrames are hashed row by row with pandas, numpy arrays
+    by their bytes, everything else by its repr.
+    :param value: value to identify
+    :return:
+    """
+    if type(value).__module__.startswith('pandas') and hasattr(value, 'columns'):
+        import pandas as pd
+
+        digest = hashlib.sha256(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr([(str(col), str(dtype)) for col, dtype in value.dtypes.items()]).encode())
+
+        return f'DataFrame:{digest.hexdigest()}'
+
+    if type(value).__module__ == 'numpy' and hasattr(value, 'tobytes'):
+        return f'ndarray:{value.dtype}:{value.shape}:{hashlib.sha256(value.tobytes()).hexdigest()}'
+
+    return repr(value)
+
+
+_result_cache: DiskCache | None = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> DiskCache:
+    """
+    Return the app's result cache, creating it on first use
+    :return:
+    """
+    global _result_cache
+
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = DiskCache(Config.server_config('cache_path'), Config.server_config('cache_bytes'))
+
+    return _result_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or clear the persistent result cache')
+    parser.add_argument('command', choices=['info', 'list', 'clear'])
+    parser.add_argument('--kind', help='only consider results of this kind e.g. summary, distribution')
+    args = parser.parse_args()
+
+    cache = get_result_cache()
+
+    if args.command == 'info':
+        entries = cache.entries(args.kind)
+        used = sum(size for _, size, _, _ in entries)
+        print(f'Cache file:  {cache.path}')
+        print(f'Results:     {len(entries)}')
+        print(f'Size:        {used / 2 ** 20:.1f} MiB of {cache.max_bytes / 2 ** 20:.1f} MiB')
+
+    elif args.command == 'list':
+        for key, size, created, accessed in cache.entries(args.kind):
+            created, accessed = (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) for t in (created, accessed))
+            print(f'{key}  {size / 2 ** 10:10.1f} KiB  created {created}  used {accessed}')
+
+    elif args.command == 'clear':
+        print(f'Removed {cache.clear(args.kind)} results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import os
+import atexit
+import logging
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class DataCatalogue:
+    """
+    In-memory catalogue of the data files found in a directory.
+
+    The directory is listed once when the catalogue starts; from then on a daemon thread keeps the catalogue up to
+    date, either from inotify events (through `watchfiles`) or, if those are not available, by polling the directory.
+    Sessions read the catalogue instead of the filesystem, and can watch `version` to find out when it changed.
+
+    Besides the file path, every entry records the file size and modification time, and - filled in by the watcher
+    thread, as it requires reading the file - the row count and the column schema.
+    """
+
+    def __init__(self, data_dir: str, poll_interval: float = 5):
+        self.data_dir = data_dir
+        self.poll_interval = poll_interval
+
+        self._entries: dict[str, dict] = {}
+        self._version = 0
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[set[str]], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def version(self) -> int:
+        """Incremented every time a file is added, removed or modified"""
+        return self._version
+
+    def files(self) -> list[tuple[str, str]]:
+        """
+        Return the catalogued files as (name, path) pairs, sorted by name
+        :return:
+        """
+        with self._lock:
+            return sorted((name, entry['path']) for name, entry in self._entries.items())
+
+    def entry(self, name: str) -> dict:
+        """
+        Return the catalogue entry of a file: path, size, mtime, rows and columns. `rows` and `columns` are None until
+        the file has been inspected.
+        :param name: file name as returned by `files`
+        :return:
+        """
+        with self._lock:
+            return dict(self._entries[name])
+
+    def on_change(self, callback: Callable[[set[str]], None]):
+        """
+        Register a callback that is called with the paths of modified or removed files
+        :param callback: function taking a set of file paths
+        :return:
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """
+        List the directory and start the watcher thread
+        :return:
+        """
+        if self._thread is not None:
+            return
+
+        self.refresh(inspect=False)
+
+        self._thread = threading.Thread(target=self._watch, name='data-catalogue', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Stop the watcher thread
+        :return:
+        """
+        self._stop.set()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+    def refresh(self, inspect: bool = True):
+        """
+        Re-list the data directory and update the entries of new, modified and removed files.
+        :param inspect: whether to read new and modified files for their row count and column schema
+        :return:
+        """
+        found = {}
+        with os.scandir(self.data_dir) as it:
+            for file in it:
+                if file.is_file():
+                    stat = file.stat()
+                    found[file.name[:-4]] = {'path': file.path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                             'rows': None, 'columns': None}
+
+        with self._lock:
+            changed = {entry['path'] for name, entry in self._entries.items()
+                       if name not in found or (entry['size'], entry['mtime']) !=
+                       (found[name]['size'], found[name]['mtime'])}
+            added = found.keys() - self._entries.keys()
+
+            for name, entry in found.items():
+                old = self._entries.get(name)
+                if old is not None and (old['size'], old['mtime']) == (entry['size'], entry['mtime']):
+                    found[name] = old
+
+            self._entries = found
+
+            if changed or added:
+                self._version += 1
+
+        if changed:
+            for callback in self._listeners:
+                callback(changed)
+
+        if inspect:
+            self.inspect_files()
+
+    def inspect_files(self):
+        """
+        Read the row count and column schema of every file that has not been inspected yet
+        :return:
+        """
+        with self._lock:
+            pending = [(name, entry['path'], entry['mtime']) for name, entry in self._entries.items()
+                       if entry['columns'] is None]
+
+        for name, file_path, mtime in pending:
+            try:
+                rows, columns = inspect_data_file(file_path)
+            except Exception:
+                logger.warning('Could not inspect data file "%s"', file_path, exc_info=True)
+                continue
+
+            with self._lock:
+                entry = self._entries.get(name)
+                # Skip the update if the file changed while it was being read
+                if entry is not None and entry['mtime'] == mtime:
+                    entry['rows'] = rows
+                    entry['columns'] = columns
+                    self._version += 1
+
+    def _watch(self):
+        self.inspect_files()
+
+        try:
+            from watchfiles import watch
+
+            for _ in watch(self.data_dir, stop_event=self._stop, recursive=False):
+                self.refresh()
+        except Exception:
+            logger.info('Watching "%s" for changes is not available, polling every %s seconds instead',
+                        self.data_dir, self.poll_interval, exc_info=True)
+
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    self.refresh()
+                except OSError:
+                    logger.warning('Could not list data directory "%s"', self.data_dir, exc_info=True)
+
+
+def inspect_data_file(file_path: str, sample_rows: int = 1000) -> tuple[int, dict[str, str]]:
+    """
+    Count the rows of a CSV file and infer its column schema from the first `sample_rows` rows
+    :param file_path: path to a CSV file
+    :param sample_rows: number of rows used to infer the column types
+    :return: (number of data rows, {column name: dtype name})
+    """
+    import pandas as pd
+
+    sample = pd.read_csv(file_path, nrows=sample_rows)
+    columns = {col: str(dtype) for col, dtype in sample.dtypes.items()}
+
+    lines = 0
+    last = b'\n'
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+
+    if last != b'\n':
+        lines += 1
+
+    return max(lines - 1, 0), columns
@@ -1,3 +1,5 @@
+import os
+
 from shiny import ui
 
 
@@ -25,26 +27,55 @@ class Config:
             '1.029-.394 1.029-.927 0-.552-.42-.94-1.029-.94-.584 0-1.009.388-1.009.94 0 .533.425.927 1.01.927z"/></svg>'
         )
     }
-    __server_config = {}
+    __server_config = {
+        'warm_up': os.environ.get('STATS_SHOWCASE_WARM_UP', '1') != '0',
+        'catalogue_poll_interval': 5,
+        'cache_path': os.environ.get('STATS_SHOWCASE_CACHE',
+                                     os.path.join(os.path.dirname(__file__), '.cache', 'results.sqlite')),
+        'cache_bytes': 512 * 2 ** 20,
+        'memory_budget_bytes': int(os.environ.get('STATS_SHOWCASE_MEMORY_BUDGET', 2 * 2 ** 30)),
+        'session_memory_budget_bytes': int(os.environ.get('STATS_SHOWCASE_SESSION_MEMORY_BUDGET', 256 * 2 ** 20)),
+        'session_idle_seconds': 600,
+        'memory_sweep_seconds': 30,
+        # Evicted session state is spilled to its own file, apart from the result cache
+        'spill_path': os.environ.get('STATS_SHOWCASE_SPILL',
+                                     os.path.join(os.path.dirname(__file__), '.cache', 'spill.sqlite')),
+        'spill_bytes': 4 * 2 ** 30,
+        # 'numpy' encodes DataGrid payloads column by column from NumPy buffers, 'pandas' uses shiny's encoder
+        'grid_serializer': os.environ.get('STATS_SHOWCASE_GRID_SERIALIZER', 'numpy')
+    }
     __input_config = {
         'summary': {
-            'operations': ['min', 'max', 'mean'],
-            'fallback': ['count']
+            'operations': ['min', 'max', 'mean', 'median', 'nunique'],
+            'fallback': ['count'],
+            'sample_size': 10000,
+            'confidence': 0.1,
+            'bootstrap_resamples': 1000,
+            'window_operations': ['mean', 'min', 'max', 'sum'],
+            'window_kinds': ['Rolling', 'Expanding'],
+            'window': 3,
+            'resample': 1
         },
         'distributions': {
             'continuous': {
                 'standard': ['Observations', 'PDF', 'CDF'],
                 'names': ['Uniform', 'Normal', 'Exponential', 'Cauchy'],
                 'methods': ['Log PDF', 'Log CDF', 'SF', 'Log SF'],
-                'extra_methods': ['PPF', 'ISF']
+                'extra_methods': ['PPF', 'ISF'],
+                'scalar_methods': ['Interval', 'Moment', 'Expect']
             },
             'discrete': {
                 'standard': ['Observations', 'PMF', 'CDF'],
                 'names': ['Binomial', 'Geometric', 'Poisson'],
                 'methods': ['Log PMF', 'Log CDF', 'SF', 'Log SF'],
-                'extra_methods': ['PPF', 'ISF']
+                'extra_methods': ['PPF', 'ISF'],
+                'scalar_methods': ['Interval', 'Moment', 'Expect']
             },
             'multivariate': {
+                'standard': ['Observations', 'Density'],
+                'names': ['Multivariate Normal', 'Dirichlet', 'Multinomial'],
+                'methods': ['Log Density'],
+                'extra_methods': []
             },
             'mean': 1,
             'sd': 1.1,
@@ -57,11 +88,25 @@ class Config:
             'low': 0,
             'high': 1,
             'confidence': 0.1,
+            'bootstrap_resamples': 1000,
+            'mean_vector': '0, 0',
+            'covariance': '1, 0.5; 0.5, 1',
+            'concentration': '1, 2, 3',
+            'probabilities': '0.2, 0.3, 0.5',
+            'histogram_bins': 50,
+            'interval_confidence': 0.95,
+            'moment_order': 3,
             'lb': 10,
             'ub': 100
         },
-        'statistical_testing':{
-            'tests': ['t-test', 'z-test', 'Wilcoxon', 'ANOVA']
+        'export': {
+            'formats': ['CSV', 'Parquet', 'Arrow IPC'],
+            'chunk_rows': 50000
+        },
+        'statistical_testing': {
+            'tests': ['t-test', 'z-test', 'Wilcoxon', 'ANOVA'],
+            'corrections': ['holm', 'bonferroni', 'fdr_bh', 'none'],
+            'alpha': 0.05
         }
     }
 
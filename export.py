@@ -0,0 +1,122 @@
+"""
+Streaming export of data frames as CSV, Parquet or Arrow IPC.
+
+A frame is serialised `chunk_rows` rows at a time and every chunk is handed to the response as soon as it is ready,
+so the serialised file is never held in memory as a whole. Parquet and Arrow writers write into a sink that is
+drained after every chunk (one Parquet row group or Arrow record batch per chunk). Serialisation runs in a worker
+thread, one chunk at a time, so a large export does not block the event loop and with it every other session.
+"""
+from __future__ import annotations
+
+import io
+import asyncio
+import importlib.util
+from typing import TYPE_CHECKING, AsyncIterator, Iterator
+
+from config import Config
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+export_config = Config.input_config('export')
+
+# Format -> (file extension, media type)
+export_formats = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Arrow IPC': ('arrow', 'application/vnd.apache.arrow.file')
+}
+
+
+def available_formats() -> list[str]:
+    """
+    Export formats that can be written with the installed packages; Parquet and Arrow IPC need pyarrow
+    :return:
+    """
+    has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+
+    return [fmt for fmt in export_config['formats'] if fmt == 'CSV' or has_pyarrow]
+
+
+def export_filename(name: str, export_format: str) -> str:
+    return f'{name.lower().replace(" ", "_")}.{export_formats[export_format][0]}'
+
+
+def export_media_type(export_format: str) -> str:
+    return export_formats[export_format][1]
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file collecting whatever the writer produced since the last `drain`
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_export(data_frame: pd.DataFrame, export_format: str, chunk_rows: int = None) -> Iterator[bytes]:
+    """
+    Serialise a data frame chunk by chunk
+    :param data_frame: frame to export, its index is not exported
+    :param export_format: one of `export_formats`
+    :param chunk_rows: rows serialised at a time
+    :return: iterator over the bytes of the file
+    """
+    chunk_rows = chunk_rows or export_config['chunk_rows']
+    starts = range(0, len(data_frame), chunk_rows)
+
+    if export_format == 'CSV':
+        yield data_frame.iloc[:0].to_csv(index=False).encode()
+        for start in starts:
+            yield data_frame.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode()
+        return
+
+    if export_format not in export_formats:
+        raise ValueError(f'"{export_format}" is not a supported export format')
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    schema = pa.Schema.from_pandas(data_frame.iloc[:chunk_rows], preserve_index=False)
+
+    if export_format == 'Parquet':
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    with writer:
+        for start in starts:
+            chunk = data_frame.iloc[start:start + chunk_rows]
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+
+    # Footer
+    yield sink.drain()
+
+
+async def stream_export(data_frame: pd.DataFrame, export_format: str, chunk_rows: int = None) -> AsyncIterator[bytes]:
+    """
+    `iter_export`, serialising every chunk in a worker thread; usable as the body of a download handler
+    :param data_frame: frame to export, its index is not exported
+    :param export_format: one of `export_formats`
+    :param chunk_rows: rows serialised at a time
+    :return: async iterator over the bytes of the file
+    """
+    chunks = iter_export(data_frame, export_format, chunk_rows)
+
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        if chunk:
+            yield chunk
@@ -0,0 +1,139 @@
+"""
+Binned kernel density estimates, used to overlay a smooth density on the distribution histogram.
+
+`scipy.stats.gaussian_kde` evaluates every kernel at every grid point, O(observations * grid points). Here the sample
+is first linearly binned onto a regular grid, O(observations), and the binned counts are convolved with the Gaussian
+kernel with an FFT, O(grid points * log(grid points)), so large samples cost little more than the binning. Linear
+binning moves every observation by less than one grid step, so with a grid step of at most a quarter of the bandwidth
+the estimate agrees with the exact KDE to about 1e-3 relative.
+
+Heavy-tailed samples (e.g. 10^6 Cauchy draws) span far more bandwidths than the grid can hold. Their grid is then cut
+to the central `1 - 2 * TAIL` of the sample, the tails still counting towards the normalisation, and if it is still
+too coarse the bandwidth is widened to `MIN_STEPS_PER_BANDWIDTH` grid steps, so the estimate keeps integrating to one.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from cache import fingerprint
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Number of grid points per bandwidth, and the bounds of the grid size
+GRID_RESOLUTION = 4
+MIN_GRID_SIZE = 512
+MAX_GRID_SIZE = 2 ** 14
+# The grid extends this many bandwidths beyond the sample
+CUT = 3
+# Share of the sample left out of each end of a grid that would exceed MAX_GRID_SIZE
+TAIL = 0.001
+MIN_STEPS_PER_BANDWIDTH = 2
+
+# Recently computed estimates, keyed by sample content
+KDE_CACHE_SIZE = 32
+_kde_cache = OrderedDict()
+_kde_cache_lock = threading.Lock()
+
+
+def select_bandwidth(sample: np.ndarray, method: str = 'silverman') -> float:
+    """
+    Rule of thumb bandwidth of a Gaussian kernel
+    :param sample: 1-D sample
+    :param method: 'silverman' (robust to outliers and heavy tails) or 'scott'
+    :return:
+    """
+    import numpy as np
+
+    n = len(sample)
+    sd = sample.std(ddof=1) if n > 1 else 0.0
+
+    if method == 'scott':
+        spread = sd
+        factor = 1.059
+    elif method == 'silverman':
+        q75, q25 = np.percentile(sample, [75, 25])
+        spread = min(sd, (q75 - q25) / 1.349) or sd
+        factor = 0.9
+    else:
+        raise ValueError(f'"{method}" is not a supported bandwidth selection method')
+
+    # A sample without any spread still gets a visible kernel
+    return factor * spread * n ** -0.2 if spread > 0 else 1.0
+
+
+def binned_kde(sample: np.ndarray, bandwidth: str | float = 'silverman') -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gaussian kernel density estimate on a regular grid, from linear binning and FFT convolution
+    :param sample: 1-D sample
+    :param bandwidth: bandwidth, or the name of the method selecting it, see `select_bandwidth`
+    :return: (grid, density)
+    """
+    import numpy as np
+
+    sample = np.asarray(sample, dtype=np.float64)
+    sample = sample[np.isfinite(sample)]
+    n = len(sample)
+
+    h = select_bandwidth(sample, bandwidth) if isinstance(bandwidth, str) else float(bandwidth)
+
+    low, high = sample.min() - CUT * h, sample.max() + CUT * h
+    if GRID_RESOLUTION * (high - low) / h > MAX_GRID_SIZE:
+        lower_tail, upper_tail = np.quantile(sample, [TAIL, 1 - TAIL])
+        low, high = lower_tail - CUT * h, upper_tail + CUT * h
+
+    grid_size = int(np.clip(2 ** math.ceil(math.log2(GRID_RESOLUTION * (high - low) / h)),
+                            MIN_GRID_SIZE, MAX_GRID_SIZE))
+    grid = np.linspace(low, high, grid_size)
+    delta = grid[1] - grid[0]
+    # A kernel narrower than the grid step would collapse to a single grid point
+    h = max(h, MIN_STEPS_PER_BANDWIDTH * delta)
+
+    # Linear binning: every observation is split between its two neighbouring grid points; observations beyond the
+    # grid are left out, but still count in `n`
+    sample = sample[(sample >= low) & (sample <= high)]
+    position = (sample - low) / delta
+    left = np.minimum(position.astype(np.int64), grid_size - 2)
+    right_share = position - left
+    counts = (np.bincount(left, weights=1 - right_share, minlength=grid_size) +
+              np.bincount(left + 1, weights=right_share, minlength=grid_size))
+
+    # The kernel is cut at 5 bandwidths, beyond which it is below 4e-6 of its peak
+    reach = min(grid_size - 1, math.ceil(5 * h / delta))
+    offsets = np.arange(-reach, reach + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / h) ** 2) / (h * math.sqrt(2 * math.pi))
+
+    size = 2 ** math.ceil(math.log2(grid_size + 2 * reach + 1))
+    convolved = np.fft.irfft(np.fft.rfft(counts, size) * np.fft.rfft(kernel, size), size)
+    density = convolved[reach:reach + grid_size] / n
+
+    return grid, np.maximum(density, 0)
+
+
+def sample_kde(sample: np.ndarray, bandwidth: str | float = 'silverman') -> tuple[np.ndarray, np.ndarray]:
+    """
+    `binned_kde` of a sample, reused while the sample does not change, e.g. when only the plotted properties do
+    :param sample: 1-D sample
+    :param bandwidth: bandwidth, or the name of the method selecting it, see `select_bandwidth`
+    :return: (grid, density)
+    """
+    import numpy as np
+
+    key = (fingerprint(np.ascontiguousarray(sample, dtype=np.float64)), bandwidth)
+
+    with _kde_cache_lock:
+        if key in _kde_cache:
+            _kde_cache.move_to_end(key)
+            return _kde_cache[key]
+
+    estimate = binned_kde(sample, bandwidth)
+
+    with _kde_cache_lock:
+        _kde_cache[key] = estimate
+        while len(_kde_cache) > KDE_CACHE_SIZE:
+            _kde_cache.popitem(last=False)
+
+    return estimate
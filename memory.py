@@ -0,0 +1,351 @@
+"""
+Per-session memory budgeting of the large reactive state: data frames and distribution samples.
+
+Every session keeps its data in `BudgetedValue`s instead of plain `reactive.Value`s. Setting a value records its size
+against the session. The budget is enforced whenever a value is set, and every `memory_sweep_seconds` by a background
+sweep, so that idle sessions are evicted even when no other session is active:
+
+* the payloads of sessions that have not read any of their values for `session_idle_seconds` are evicted;
+* a session over `session_memory_budget` loses its largest payloads first;
+* while all sessions together are over `memory_budget`, the least recently read payloads are evicted.
+
+The value being set is never evicted by its own `set`. Evicting a payload does not invalidate anything: the next read
+transparently brings it back, either by calling the value's `reload` function (for state that is cheap to recompute,
+e.g. re-reading columns of a data file) or from the spill store the payload was written to. The spill store is an
+SQLite file of its own, so spilled session state never pushes persisted results out of the result cache, and payloads
+are written to it by a background thread, so that a large spill does not block the event loop. Evictions, reclaimed
+bytes and reloads are counted and logged; see `MemoryBudget.metrics`.
+"""
+from __future__ import annotations
+
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from shiny import reactive
+from shiny.types import SilentException
+
+from config import Config
+from cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+_evicted = object()
+_unset = object()
+
+
+def payload_size(value) -> int:
+    """
+    Approximate memory held by a value: DataFrames and numpy arrays by their buffers, containers by their items
+    :param value: value to measure
+    :return: size in bytes
+    """
+    if type(value).__module__.startswith('pandas') and hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, 'sum') else usage)
+    if type(value).__module__ == 'numpy' and hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(payload_size(k) + payload_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(payload_size(v) for v in value)
+
+    return sys.getsizeof(value)
+
+
+class BudgetedValue:
+    """
+    Drop-in replacement of `reactive.Value` whose payload can be evicted by the `MemoryBudget` it belongs to
+    """
+
+    def __init__(self, budget: MemoryBudget, session_id: str, name: str):
+        self.budget = budget
+        self.session_id = session_id
+        self.name = name
+        self.size = 0
+        self.accessed = time.monotonic()
+
+        # Dependents are invalidated through the version only, so evicting and reloading the payload is invisible
+        self._version = reactive.Value(0)
+        self._counter = 0
+        self._payload = _unset
+        self._reload: Callable[[], Any] | None = None
+        self._spill_key: str | None = None
+        # Payload being written to the spill store, still readable until the write is done
+        self._spilling = None
+
+    def __call__(self):
+        return self.get()
+
+    def get(self):
+        self._version()
+        self.accessed = time.monotonic()
+
+        # Read once, the sweep may evict the payload from another thread
+        payload = self._payload
+        if payload is _unset:
+            raise SilentException()
+        if payload is _evicted:
+            payload = self.budget.reload(self)
+
+        return payload
+
+    def set(self, value, reload: Callable[[], Any] = None):
+        """
+        Set the value
+        :param value: new value
+        :param reload: function without arguments recomputing `value` after an eviction; without it evicted values are
+            spilled to the spill store
+        :return:
+        """
+        self._payload = value
+        self._reload = reload
+        self.accessed = time.monotonic()
+        # A plain counter, as reading the reactive version here would make the caller depend on it
+        self._counter += 1
+        self._version.set(self._counter)
+
+        self.budget.track(self, payload_size(value))
+
+    @property
+    def resident(self) -> bool:
+        return self._payload is not _unset and self._payload is not _evicted
+
+
+class MemoryBudget:
+    """
+    Memory accounting of the `BudgetedValue`s of all sessions, with a global and a per-session budget
+    """
+
+    def __init__(self, max_bytes: int, session_max_bytes: int, idle_seconds: float, spill_store: DiskCache):
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_store = spill_store
+
+        self._sessions: dict[str, dict[str, BudgetedValue]] = {}
+        self._lock = threading.RLock()
+        self._metrics = {'evictions': 0, 'reclaimed_bytes': 0, 'reloads': 0, 'spill_misses': 0}
+        # A single writer keeps spills and the deletion of their keys in order
+        self._spiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory-spill')
+
+    def value(self, session, name: str) -> BudgetedValue:
+        """
+        Create a budgeted value of a session; its values are released when the session ends
+        :param session: shiny session
+        :param name: name of the value, unique within the session
+        :return:
+        """
+        with self._lock:
+            if session.id not in self._sessions:
+                self._sessions[session.id] = {}
+                session.on_ended(lambda: self.release(session.id))
+
+            value = self._sessions[session.id][name] = BudgetedValue(self, session.id, name)
+
+        return value
+
+    def track(self, value: BudgetedValue, size: int):
+        with self._lock:
+            self._forget_spill(value)
+
+            value.size = size
+            self.enforce(keep=value)
+
+    def start_sweep(self, interval: float) -> threading.Thread:
+        """
+        Enforce the budget every `interval` seconds in a daemon thread
+        :param interval: seconds between sweeps
+        :return:
+        """
+        def sweep():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.enforce()
+                except Exception:
+                    logger.exception('Memory budget sweep failed')
+
+        thread = threading.Thread(target=sweep, name='memory-sweep', daemon=True)
+        thread.start()
+
+        return thread
+
+    def enforce(self, keep: BudgetedValue = None):
+        """
+        Evict payloads until every session and all sessions together are within budget
+        :param keep: value that must stay resident, e.g. because it was just set
+        :return:
+        """
+        with self._lock:
+            now = time.monotonic()
+            resident = [v for values in self._sessions.values() for v in values.values()
+                        if v.resident and v is not keep]
+
+            last_read = {}
+            for session_id, values in self._sessions.items():
+                last_read[session_id] = max((v.accessed for v in values.values()), default=now)
+
+            for value in resident:
+                if now - last_read[value.session_id] > self.idle_seconds:
+                    self.evict(value, 'idle session')
+
+            for session_id, values in self._sessions.items():
+                session_values = [v for v in values.values() if v.resident]
+                used = self.resident_bytes(session_id)
+                for value in sorted(session_values, key=lambda v: v.size, reverse=True):
+                    if used <= self.session_max_bytes:
+                        break
+                    if value is not keep:
+                        used -= value.size
+                        self.evict(value, 'session over budget')
+
+            used = self.resident_bytes()
+            for value in sorted((v for v in resident if v.resident), key=lambda v: v.accessed):
+                if used <= self.max_bytes:
+                    break
+                used -= value.size
+                self.evict(value, 'memory budget exceeded')
+
+    def evict(self, value: BudgetedValue, reason: str):
+        with self._lock:
+            if not value.resident:
+                return
+            if self._shared(value):
+                # Another value holds the same payload, dropping this reference would not free anything
+                return
+
+            if value._reload is None:
+                # The payload stays reachable through `_spilling` until the spill store has it
+                value._spill_key = self.spill_store.key('session', value.session_id, value.name, value._counter)
+                value._spilling = value._payload
+                value._payload = _evicted
+                self._spiller.submit(self._spill, value, value._spill_key, value._spilling, reason)
+                return
+
+            value._payload = _evicted
+            self._reclaimed(value, reason)
+
+    def _spill(self, value: BudgetedValue, spill_key: str, payload, reason: str):
+        stored = self.spill_store.set(spill_key, payload)
+
+        with self._lock:
+            if value._spill_key != spill_key:
+                # Set again, reloaded or released while being written
+                if stored:
+                    self.spill_store.delete(spill_key)
+                return
+
+            value._spilling = None
+            if not stored:
+                # Without a copy to reload from, the payload has to stay
+                value._spill_key = None
+                value._payload = payload
+                return
+
+            self._reclaimed(value, reason)
+
+    def _reclaimed(self, value: BudgetedValue, reason: str):
+        with self._lock:
+            self._metrics['evictions'] += 1
+            self._metrics['reclaimed_bytes'] += value.size
+
+        logger.info('Evicted "%s" of session %s (%.1f MiB, %s)', value.name, value.session_id[:8],
+                    value.size / 2 ** 20, reason)
+
+    def _forget_spill(self, value: BudgetedValue):
+        # Drop the spilled copy of a value, or cancel its pending spill
+        with self._lock:
+            if value._spill_key is not None:
+                self._spiller.submit(self.spill_store.delete, value._spill_key)
+            value._spill_key = None
+            value._spilling = None
+
+    def reload(self, value: BudgetedValue):
+        with self._lock:
+            self._metrics['reloads'] += 1
+            spill_key, spilling = value._spill_key, value._spilling
+
+        if value._reload is not None:
+            payload = value._reload()
+        elif spilling is not None:
+            payload = spilling
+        else:
+            payload = self.spill_store.get(spill_key, _evicted)
+            if payload is _evicted:
+                # The spilled payload was itself evicted from the spill store; the value behaves as if unset
+                with self._lock:
+                    self._metrics['spill_misses'] += 1
+                    self._forget_spill(value)
+                value._payload = _unset
+                raise SilentException()
+
+        # Only drop the spilled copy once it has been read, its deletion is queued behind any pending write
+        with self._lock:
+            if value._spill_key == spill_key:
+                self._forget_spill(value)
+
+        logger.info('Reloaded "%s" of session %s', value.name, value.session_id[:8])
+        value._payload = payload
+        self.enforce(keep=value)
+
+        return payload
+
+    def release(self, session_id: str):
+        """
+        Forget all values of a session, removing their spilled payloads
+        :param session_id: id of an ended session
+        :return:
+        """
+        with self._lock:
+            for value in self._sessions.pop(session_id, {}).values():
+                self._forget_spill(value)
+
+        logger.info('Released session %s, memory metrics: %s', session_id[:8], self.metrics())
+
+    def _shared(self, value: BudgetedValue) -> bool:
+        return any(v is not value and v.resident and v._payload is value._payload
+                   for values in self._sessions.values() for v in values.values())
+
+    def resident_bytes(self, session_id: str = None) -> int:
+        """
+        :param session_id: only count the values of this session
+        :return: bytes held by resident payloads, a payload held by several values being counted once
+        """
+        with self._lock:
+            sessions = [self._sessions.get(session_id, {})] if session_id else self._sessions.values()
+            payloads = {id(v._payload): v.size for values in sessions for v in values.values() if v.resident}
+            return sum(payloads.values())
+
+    def metrics(self) -> dict[str, int]:
+        """
+        :return: number of sessions, resident bytes, and the evictions, reclaimed bytes and reloads so far
+        """
+        with self._lock:
+            return {'sessions': len(self._sessions), 'resident_bytes': self.resident_bytes(), **self._metrics}
+
+
+_memory_budget: MemoryBudget | None = None
+_memory_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> MemoryBudget:
+    """
+    Return the app's memory budget, creating it and starting its sweep on first use
+    :return:
+    """
+    global _memory_budget
+
+    with _memory_budget_lock:
+        if _memory_budget is None:
+            spill_store = DiskCache(Config.server_config('spill_path'), Config.server_config('spill_bytes'))
+            _memory_budget = MemoryBudget(Config.server_config('memory_budget_bytes'),
+                                          Config.server_config('session_memory_budget_bytes'),
+                                          Config.server_config('session_idle_seconds'),
+                                          spill_store)
+            _memory_budget.start_sweep(Config.server_config('memory_sweep_seconds'))
+
+    return _memory_budget
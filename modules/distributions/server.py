@@ -4,10 +4,14 @@ from shiny import Inputs, Outputs, Session, module, render, ui, reactive
 
 from shinywidgets import render_widget
 
-import plotly.graph_objs as go
-from plotly.subplots import make_subplots
-
 from utils import synchronize_size, create_distribution_df
+from cache import get_result_cache
+from bootstrap import bootstrap_stats
+from expectations import dist_interval, dist_moment, dist_expect, frozen_dist
+from kde import sample_kde
+from export import stream_export, export_filename, export_media_type
+from serialization import RoundedDataGrid
+from multivariate import parse_vector, parse_matrix, create_multivariate_df, pairwise_histograms
 
 from config import Config
 
@@ -17,6 +21,7 @@ dist_defaults = config.input_config('distributions')
 
 cont_dist = dist_defaults['continuous']
 discrete_dist = dist_defaults['discrete']
+multivariate_dist = dist_defaults['multivariate']
 
 
 # TODO fix this MathJax. It works only once. On change of distribution the TypeSet is no
@@ -49,15 +54,64 @@ discrete_dist = dist_defaults['discrete']
 
 
 @module.server
-def create_dist_details(input: Inputs, output: Outputs, session: Session, data_frame):
+def create_dist_details(input: Inputs, output: Outputs, session: Session, data_frame, sample=None,
+                        parameters=None, random_state=None):
+    @reactive.Calc
+    def intervals():
+        # Opt-in: a thousand resamples of a large sample take seconds
+        if sample is None or parameters is None or not input.bootstrap():
+            return {}
+
+        dist_name = parameters[0]
+        resamples, confidence = dist_defaults['bootstrap_resamples'], dist_defaults['confidence']
+
+        def compute():
+            return bootstrap_stats(sample, dist_name, resamples, confidence, random_state=random_state)
+
+        if random_state is None:
+            return compute()
+
+        # Seeded samples are reproducible, and so are their intervals
+        cache = get_result_cache()
+        return cache.get_or_compute(cache.key('bootstrap', sample, dist_name, resamples, confidence, random_state),
+                                    compute)
+
     @output
     @render.text
     def details():
-        stats_body = '\n'.join([f'{k}: {v}' for k, v in data_frame.items()])
+        bounds = intervals()
+        stats_body = '\n'.join([f'{k}: {v}' + (f' [{bounds[k][0]:.4f}, {bounds[k][1]:.4f}]' if k in bounds else '')
+                                 for k, v in data_frame.items()])
+
+        scalar_body = ''
+        if parameters is not None:
+            dist_name, params = parameters
+            scalar_props = input.scalar_prop() or ()
+            scalar_lines = []
+
+            # Cleared numeric inputs are None: their line is left out until they are filled in again
+            if 'Interval' in scalar_props and input.interval_confidence() is not None:
+                confidence = min(max(input.interval_confidence(), 0), 1)
+                low, high = dist_interval(dist_name, params, confidence)
+                scalar_lines.append(f'interval({confidence}): [{low:.4f}, {high:.4f}]')
+            if 'Moment' in scalar_props and input.moment_order() is not None:
+                order = max(int(input.moment_order()), 0)
+                scalar_lines.append(f'moment({order}): {dist_moment(dist_name, params, order):.4f}')
+            if 'Expect' in scalar_props:
+                function = input.expect_func()
+                scalar_lines.append(f'E[{function}]: {dist_expect(dist_name, params, function):.4f}')
+
+            scalar_body = ''.join(f'{line}\n' for line in scalar_lines)
+
+        intervals_note = ''
+        if bounds:
+            intervals_note = f'[{100 * (1 - dist_defaults["confidence"]):.0f}% bootstrap intervals of the sample]'
 
         return (
             f'\t~~~{input.distributions()} Distribution details~~~\n'
-            f'{stats_body}'
+            f'{stats_body}\n'
+            f'{scalar_body}'
+            f'{intervals_note}'
         )
 
 
@@ -102,6 +156,11 @@ def update_plot_prop(input: Inputs, output: Outputs, session: Session):
     @reactive.event(input.distributions, input.prop, input.extra_prop)
     def update():
         choices = []
+        if input.distributions() in multivariate_dist['names']:
+            # Multivariate distributions are plotted pairwise, see `dist_graph`
+            ui.update_checkbox_group('plot_props', choices=choices)
+            return
+
         if input.distributions() in cont_dist['names']:
             [choices.append(_) for _ in cont_dist['standard'][1:]]
         else:
@@ -132,23 +191,6 @@ def create_dist_df(input: Inputs, output: Outputs, session: Session, data_frame:
         # TODO there is a small glitch, that does not actually impair functionality.
         #   when switching distribution, because the UI loads after, it still grabs the previous dists options
         #   and tries to generate the dist with those, giving an error that fies itself after updating the input
-        """
-        ==== Discrete ====
-        To add functionalities:
-        * interval;
-
-        More complex functionality to implement:
-        * expect
-        
-        ==== Continuous ====
-        To add functionalities:
-        * interval;
-        * moment;
-
-        More complex functionality to implement:
-        * expect
-        """
-
         if input.distributions() == 'Normal':
             sd = input.sd()
             mean = input.mean()
@@ -224,10 +266,36 @@ def create_dist_df(input: Inputs, output: Outputs, session: Session, data_frame:
 
             dist_data = uniform_dist
 
+        if input.distributions() == 'Multivariate Normal':
+            mvn_dist = create_multivariate_df('multivariate_normal', obs,
+                                              {'mean': parse_vector(input.mean_vector()),
+                                               'cov': parse_matrix(input.covariance())},
+                                              random_state=random_state)
+
+            dist_data = mvn_dist
+
+        if input.distributions() == 'Dirichlet':
+            dirichlet_dist = create_multivariate_df('dirichlet', obs,
+                                                    {'alpha': parse_vector(input.concentration())},
+                                                    random_state=random_state)
+
+            dist_data = dirichlet_dist
+
+        if input.distributions() == 'Multinomial':
+            multinomial_dist = create_multivariate_df('multinomial', obs,
+                                                      {'n': input.trials(), 'p': parse_vector(input.probabilities())},
+                                                      random_state=random_state)
+
+            dist_data = multinomial_dist
+
+        # Bootstrap intervals are computed on demand by `create_dist_details`
+        dist_data['random_state'] = random_state
+
         data_frame.set(dist_data)
 
-        return render.DataGrid(
-            dist_data['distribution_df'].round(3),
+        return RoundedDataGrid(
+            dist_data['distribution_df'],
+            decimals=3,
             row_selection_mode='multiple',
             width='100%',
             height='100%',
@@ -236,45 +304,137 @@ def create_dist_df(input: Inputs, output: Outputs, session: Session, data_frame:
     return data
 
 
+@module.server
+def export_dist_df(input: Inputs, output: Outputs, session: Session, data_frame: reactive.Value):
+    @session.download(filename=lambda: export_filename(f'{input.distributions()} distribution',
+                                                       input.export_format()),
+                      media_type=lambda: export_media_type(input.export_format()))
+    async def download_data():
+        async for chunk in stream_export(data_frame()['distribution_df'], input.export_format()):
+            yield chunk
+
+
 @module.server
 def dist_graph(input: Inputs, output: Outputs, session: Session, data_frame: reactive.Value):
     @output
     @render_widget
     @reactive.event(input.plot_distribution, input.plot_other)
     def graph():
-        plot_data = data_frame()['distribution_df']
-        subplot_titles = [f'Histogram of {input.distributions()} distribution']
-        to_plots = input.plot_props()
-        widget = None
+        import plotly.graph_objs as go
 
-        for plot in input.plot_props():
-            subplot_titles.append(f'{input.distributions()} {plot} plot')
+        if input.distributions() in multivariate_dist['names']:
+            fig = pairwise_figure(data_frame()['distribution_df'], input.distributions())
+        else:
+            fig = distribution_figure(data_frame()['distribution_df'], input.distributions(), input.plot_props(),
+                                      data_frame()['parameters'])
 
-        fig = make_subplots(rows=1, cols=1 + len(to_plots), subplot_titles=subplot_titles)
+        widget = go.FigureWidget(fig)
 
-        fig.layout.title = f'{input.distributions()} Distribution plots'
-        fig.layout.width, fig.layout.height = 1500, 600
+        @synchronize_size("graph")
+        def on_size_changed(width, height):
+            widget.layout.width = width
+            widget.layout.height = height
 
-        hist_trace = go.Histogram(x=plot_data['Observations'], name='Observations')
+        return widget
 
+    return graph
+
+
+def distribution_figure(plot_data, dist_name: str, to_plots: list[str], parameters: tuple = None):
+    """
+    Density histogram of the observations of a univariate distribution, overlaid with the analytic PDF/PMF and, for
+    continuous distributions, a kernel density estimate; next to a scatter plot of every chosen property
+    :param plot_data: distribution data frame
+    :param dist_name: distribution name, as shown in the UI
+    :param to_plots: properties to plot against the observations
+    :param parameters: (scipy.stats name, frozen parameters) of the distribution, no PDF/PMF is drawn without them
+    :return:
+    """
+    import numpy as np
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+
+    continuous = dist_name in cont_dist['names']
+    observations = plot_data['Observations'].to_numpy()
+
+    subplot_titles = [f'Histogram of {dist_name} distribution']
+
+    for plot in to_plots:
+        subplot_titles.append(f'{dist_name} {plot} plot')
+
+    fig = make_subplots(rows=1, cols=1 + len(to_plots), subplot_titles=subplot_titles)
+
+    fig.layout.title = f'{dist_name} Distribution plots'
+    fig.layout.width, fig.layout.height = 1500, 600
+
+    if continuous:
+        hist_trace = go.Histogram(x=observations, name='Observations', histnorm='probability density')
+        grid, density = sample_kde(observations)
+        fig.add_trace(hist_trace, 1, 1)
+        fig.add_trace(go.Scatter(x=grid, y=density, mode='lines', name='KDE'), 1, 1)
+    else:
+        # One bar per value, so bar heights are comparable to the PMF
+        hist_trace = go.Histogram(x=observations, name='Observations', histnorm='probability', xbins={'size': 1})
+        grid = np.arange(observations.min(), observations.max() + 1)
         fig.add_trace(hist_trace, 1, 1)
 
-        fig.update_xaxes(title_text="Observations", row=1, col=1)
-        fig.update_yaxes(title_text='Count', row=1, col=1)
+    if parameters is not None:
+        dist = frozen_dist(*parameters)
+        if continuous:
+            fig.add_trace(go.Scatter(x=grid, y=dist.pdf(grid), mode='lines', name='PDF'), 1, 1)
+        else:
+            fig.add_trace(go.Scatter(x=grid, y=dist.pmf(grid), mode='markers', name='PMF'), 1, 1)
 
-        for c in range(1, len(to_plots) + 1):
-            scatter = go.Scatter(x=plot_data['Observations'], y=plot_data[to_plots[c - 1]],
-                                 mode='markers', name=to_plots[c - 1])
+    fig.update_xaxes(title_text="Observations", row=1, col=1)
+    fig.update_yaxes(title_text='Density' if continuous else 'Probability', row=1, col=1)
 
-            fig.add_trace(scatter, row=1, col=1 + c)
-            fig.update_xaxes(title_text="Observations", row=1, col=1 + c)
-            fig.update_yaxes(title_text=to_plots[c - 1], row=1, col=1 + c)
+    for c in range(1, len(to_plots) + 1):
+        scatter = go.Scatter(x=plot_data['Observations'], y=plot_data[to_plots[c - 1]],
+                             mode='markers', name=to_plots[c - 1])
 
-        widget = go.FigureWidget(fig)
+        fig.add_trace(scatter, row=1, col=1 + c)
+        fig.update_xaxes(title_text="Observations", row=1, col=1 + c)
+        fig.update_yaxes(title_text=to_plots[c - 1], row=1, col=1 + c)
 
-        @synchronize_size("graph")
-        def on_size_changed(width, height):
-            widget.layout.width = width
-            widget.layout.height = height
+    return fig
 
-        return widget
+
+def pairwise_figure(plot_data, dist_name: str):
+    """
+    Scatter-matrix style grid of a multivariate distribution: a histogram of every component on the diagonal and a
+    2-D histogram heatmap of every pair of components off it. Counts are binned on the server, so the figure stays
+    the same size however many observations there are.
+    :param plot_data: multivariate distribution data frame
+    :param dist_name: distribution name, as shown in the UI
+    :return:
+    """
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+
+    components = [col for col in plot_data.columns if col.startswith('Observations')]
+    histograms = pairwise_histograms(plot_data[components].to_numpy(), dist_defaults['histogram_bins'])
+    centers = [(edges[:-1] + edges[1:]) / 2 for edges in histograms['edges']]
+    dims = len(components)
+
+    fig = make_subplots(rows=dims, cols=dims, horizontal_spacing=0.03, vertical_spacing=0.03)
+
+    fig.layout.title = f'{dist_name} Distribution pairwise plots'
+    fig.layout.width, fig.layout.height = 1500, 600
+    fig.layout.showlegend = False
+
+    for i in range(dims):
+        for j in range(dims):
+            if i == j:
+                trace = go.Bar(x=centers[i], y=histograms[i, i], name=components[i])
+            else:
+                trace = go.Heatmap(x=centers[j], y=centers[i], z=histograms[i, j], coloraxis='coloraxis',
+                                   name=f'{components[i]} / {components[j]}')
+
+            fig.add_trace(trace, row=i + 1, col=j + 1)
+
+        fig.update_xaxes(title_text=components[i], row=dims, col=i + 1)
+        fig.update_yaxes(title_text=components[i], row=i + 1, col=1)
+
+    fig.update_layout(coloraxis={'colorscale': 'Blues', 'colorbar': {'title': 'Count'}}, bargap=0)
+
+    return fig
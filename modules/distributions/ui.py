@@ -2,10 +2,13 @@
 from config import Config
 from shiny import Inputs, Outputs, Session, module, render, ui, reactive
 from modules.common_ui import label_with_tooltip
+from expectations import expect_functions
+from export import available_formats
 
 config = Config()
 cont_dist = config.input_config('distributions')['continuous']
 discrete_dist = config.input_config('distributions')['discrete']
+multivariate_dist = config.input_config('distributions')['multivariate']
 qmark = config.ui_config('tooltip_q')
 
 config = Config()
@@ -13,7 +16,7 @@ graph_height = config.ui_config('graph_height')
 dist_defaults = config.input_config('distributions')
 
 
-dist_names = cont_dist['names'] + discrete_dist['names']
+dist_names = cont_dist['names'] + discrete_dist['names'] + multivariate_dist['names']
 
 @module.ui
 def distribution_selection():
@@ -23,7 +26,9 @@ def distribution_selection():
         ui.hr(),
         ui.output_ui('inputs'),
         ui.hr(),
-        ui.output_text_verbatim('details')
+        ui.output_text_verbatim('details'),
+        ui.row(ui.column(6, ui.input_select('export_format', 'Export Format', available_formats())),
+               ui.column(6, ui.download_button('download_data', 'Download Table'), class_='mt-4'))
     )
 
 @module.server
@@ -45,6 +50,7 @@ def create_dist_settings(input: Inputs, output: Outputs, session: Session):
 
         properties_tooltip_text = 'Extra properties to Table & Plot'
         seed_tooltip = 'By setting a seed the data set can be frozen'
+        scalar_tooltip = 'Properties of the distribution itself, shown in the details'
 
         dist_inputs = None
 
@@ -69,6 +75,21 @@ def create_dist_settings(input: Inputs, output: Outputs, session: Session):
             dist_inputs = (ui.column(3, ui.input_numeric('low', 'Low', value=low)),
                            ui.column(3, ui.input_numeric('high', 'High', value=high)))
 
+        elif input.distributions() == 'Multivariate Normal':
+            dist_inputs = (ui.column(6, ui.input_text('mean_vector', 'Mean Vector',
+                                                      value=dist_defaults['mean_vector'])),
+                           ui.column(6, ui.input_text_area('covariance', 'Covariance (rows separated by ;)',
+                                                           value=dist_defaults['covariance'])))
+
+        elif input.distributions() == 'Dirichlet':
+            dist_inputs = ui.column(6, ui.input_text('concentration', 'Concentration',
+                                                     value=dist_defaults['concentration']))
+
+        elif input.distributions() == 'Multinomial':
+            dist_inputs = (ui.column(3, ui.input_numeric('trials', 'Trials', value=trials)),
+                           ui.column(6, ui.input_text('probabilities', 'Probabilities',
+                                                      value=dist_defaults['probabilities'])))
+
         # elif input.distributions() == 'Cauchy':
         #     dist_inputs = (ui.column(3, ui.input_numeric('scale', 'Scale', value=scale)),
         #                    ui.column(3, ui.input_numeric('location', 'Location', value=0))
@@ -90,6 +111,26 @@ def create_dist_settings(input: Inputs, output: Outputs, session: Session):
                         ui.input_slider('observations', 'Observations', min=min_val, max=max_val,
                                         value=max_val / 2))
 
+        # Scalar properties and bootstrap intervals only exist for univariate distributions
+        if input.distributions() not in multivariate_dist['names']:
+            dist_options += (
+                ui.input_selectize('scalar_prop',
+                                   label_with_tooltip('Scalar Properties ', True, scalar_tooltip, 'right',
+                                                      'scalar_tooltip'),
+                                   cont_dist['scalar_methods'], multiple=True),
+                ui.panel_conditional("input.scalar_prop && input.scalar_prop.includes('Interval')",
+                                     ui.input_numeric('interval_confidence', 'Interval Confidence',
+                                                      value=dist_defaults['interval_confidence'],
+                                                      min=0, max=1, step=0.01)),
+                ui.panel_conditional("input.scalar_prop && input.scalar_prop.includes('Moment')",
+                                     ui.input_numeric('moment_order', 'Moment Order',
+                                                      value=dist_defaults['moment_order'], min=0, step=1)),
+                ui.panel_conditional("input.scalar_prop && input.scalar_prop.includes('Expect')",
+                                     ui.input_selectize('expect_func', 'Expected Value Of',
+                                                        list(expect_functions), multiple=False)),
+                ui.input_checkbox('bootstrap', 'Bootstrap Intervals')
+            )
+
         dist_plot = (ui.row(ui.column(5, ui.input_action_button('plot_distribution', 'Plot Histogram')),
                             ui.column(7, ui.input_checkbox('enbl_plot', 'Other Plots'))),
                      ui.panel_conditional('input.enbl_plot', ui.input_checkbox_group(
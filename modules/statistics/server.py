@@ -0,0 +1,66 @@
+import asyncio
+
+from shiny import Inputs, Outputs, Session, module, render, ui, reactive, req
+
+from utils import read_data_columns, data_source_key
+from stat_tests import run_group_tests
+from serialization import RoundedDataGrid
+
+
+@module.server
+def update_testing_inputs(input: Inputs, output: Outputs, session: Session, grouper):
+    @reactive.Effect
+    def update():
+        ui.update_selectize(
+            'group_by',
+            choices=grouper(),
+            selected=grouper()[0]
+        )
+
+    @reactive.Effect
+    @reactive.event(input.group_by)
+    def update_columns():
+        cols = grouper()[:]
+
+        # Remove from the columns input the currently selected group_by value
+        cols.remove(input.group_by())
+
+        ui.update_selectize(
+            'columns',
+            choices=cols,
+            selected=None
+        )
+
+
+@module.server
+def run_tests(input: Inputs, output: Outputs, session: Session, data_source):
+    @output
+    @render.data_frame
+    @reactive.event(input.run_tests)
+    async def data():
+        import pandas as pd
+
+        columns = list(req(input.columns()))
+        file_path, group_by = data_source(), input.group_by()
+        tests, correction, alpha = input.tests(), input.correction(), input.alpha()
+        read_columns = (group_by, *columns)
+
+        def run():
+            df = read_data_columns(file_path, read_columns)
+
+            # The tests compare means and ranks, so only numeric columns can be tested
+            numeric = [col for col in columns if pd.api.types.is_numeric_dtype(df[col])]
+
+            return run_group_tests(df, group_by, req(numeric), tests, correction, alpha,
+                                   source=data_source_key(file_path, read_columns))
+
+        # Reading the data and testing every group pair would otherwise block every session
+        results = await asyncio.to_thread(run)
+
+        return RoundedDataGrid(
+            results,
+            decimals=4,
+            row_selection_mode='multiple',
+            width='100%',
+            height='100%',
+        )
@@ -0,0 +1,19 @@
+from shiny import module, ui
+from config import Config
+
+tests = Config.input_config('statistical_testing')['tests']
+corrections = Config.input_config('statistical_testing')['corrections']
+alpha = Config.input_config('statistical_testing')['alpha']
+
+
+@module.ui
+def testing_inputs():
+    return (ui.p(ui.strong('Instructions:'),
+                 ' Load a file in the Data Summarizer tab, then select the columns to compare across groups.'),
+            ui.input_selectize('group_by', f'Group By', []),
+            ui.input_selectize('columns', f'Value Columns', [], multiple=True),
+            ui.input_selectize('tests', f'Tests', tests, selected=tests[0], multiple=True),
+            ui.input_selectize('correction', f'Multiple Comparison Correction', corrections),
+            ui.input_numeric('alpha', 'Significance Level', value=alpha, min=0, max=1, step=0.01),
+            ui.input_action_button('run_tests', 'Run Tests')
+            )
@@ -1,46 +1,56 @@
-import pandas
-
-import plotly.express as px
-import plotly.graph_objs as go
 from shiny import Inputs, Outputs, Session, module, render, ui, reactive, req
 from shinywidgets import render_widget
 
-import os
-import re
-
-from utils import get_data_files, create_summary_df, synchronize_size
+from utils import (get_catalogue, get_data_files, read_data_header, read_data_columns, create_summary_df,
+                   create_approx_summary_df, create_window_df, data_source_key, synchronize_size)
+from cache import get_result_cache
+from bootstrap import bootstrap_group_means
+from export import stream_export, export_filename, export_media_type
+from serialization import RoundedDataGrid
 from config import Config
 
 graph_height = Config.ui_config('graph_height')
+resamples = Config.input_config('summary')['bootstrap_resamples']
+confidence = Config.input_config('summary')['confidence']
+sample_size = Config.input_config('summary')['sample_size']
 
 @module.server
 def update_filename_input(input: Inputs, output: Outputs, session: Session):
+    catalogue = get_catalogue()
+
+    @reactive.poll(lambda: catalogue.version, 1)
+    def catalogue_version():
+        return catalogue.version
+
     @reactive.Effect
     def update():
-        files = [name[0] for name in get_data_files()]
+        catalogue_version()
+        files = [name[0] for name in catalogue.files()]
+
+        # Keep the user's choice when the file list is refreshed
+        with reactive.isolate():
+            selected = input.file_name() if input.file_name() in files else None
 
         ui.update_selectize(
             'file_name',
             choices=files,
-            selected=None
+            selected=selected
         )
 
 
 @module.server
-def load_data_frame(input: Inputs, output: Outputs, session: Session, grouper, original_df):
+def load_data_frame(input: Inputs, output: Outputs, session: Session, grouper, data_source):
     # also updates the 'group_by' input
+    # Only the header is read here, the data itself is read on 'Summarize' for the selected columns only
     @reactive.Effect
     @reactive.event(input.load_file)
     def load():
-        name = os.path.join('data', input.file_name() + '.csv')
-        df = pandas.read_csv(name)
-        df = df.dropna()
-        df.columns = [re.sub('[ -]{1,}', '_', col.lower().strip()) for col in df.columns]
+        file_path = dict(get_data_files())[input.file_name()]
 
-        col_names = [col for col in df.columns.values]
+        col_names = list(read_data_header(file_path))
 
         grouper.set(col_names)
-        original_df.set(df)
+        data_source.set(file_path)
 
         ui.update_selectize(
             'group_by',
@@ -48,6 +58,14 @@ def load_data_frame(input: Inputs, output: Outputs, session: Session, grouper, o
             selected=grouper()[0]
         )
 
+        # Guess the time column of year-indexed data
+        time_cols = [col for col in col_names if any(word in col for word in ['year', 'date', 'time'])]
+        ui.update_selectize(
+            'time_col',
+            choices=col_names,
+            selected=time_cols[0] if time_cols else None
+        )
+
 
 @module.server
 def update_aggregator_input(input: Inputs, output: Outputs, session: Session, grouper):
@@ -67,10 +85,18 @@ def update_aggregator_input(input: Inputs, output: Outputs, session: Session, gr
 
 
 @module.server
-def update_graph_input(input: Inputs, output: Outputs, session: Session, grouper):
+def update_graph_input(input: Inputs, output: Outputs, session: Session, grouper, data_frame):
     # Update x_axis and y_axis inputs according to the group_by and aggregator inputs
     @reactive.Effect
     def update():
+        if input.time_series():
+            # The windowed summary is plotted over time instead of the raw rows
+            y_axis = [col for col in data_frame().columns if col not in (input.group_by(), input.time_col())]
+
+            ui.update_selectize('x_ax', choices=[input.time_col()], selected=input.time_col())
+            ui.update_selectize('y_ax', choices=y_axis, selected=y_axis[-1] if y_axis else None)
+            return
+
         x_axis = grouper()
         y_axis = input.aggregator()
 
@@ -79,11 +105,12 @@ def update_graph_input(input: Inputs, output: Outputs, session: Session, grouper
 
 
 @module.server
-def load_summary_data(input: Inputs, output: Outputs, session: Session, original_df, data_frame):
+def load_summary_data(input: Inputs, output: Outputs, session: Session, data_source, original_df, data_frame):
     @output
     @render.data_frame
     @reactive.event(input.submit)
     def data():
+        import pandas as pd
 
         values = [input.group_by(), input.aggregator(), input.operations(), input.fallbacks()]
 
@@ -93,12 +120,56 @@ def load_summary_data(input: Inputs, output: Outputs, session: Session, original
                 new_value = ''.join([x for x in value])
                 values[values.index(value)] = new_value
 
-        selected_df = create_summary_df(original_df(), values[0], values[1], values[2], values[3])
+        aggregators = [values[1]] if isinstance(values[1], str) else list(values[1])
+        file_path, columns = data_source(), (values[0], *aggregators)
+        if input.time_series():
+            columns = (values[0], input.time_col(), *aggregators)
+        # Re-reading the columns is cheaper than spilling them, should the frame be evicted
+        original_df.set(read_data_columns(file_path, columns), reload=lambda: read_data_columns(file_path, columns))
+
+        cache = get_result_cache()
+        # Results are keyed by the file and columns they come from, hashing the frame would cost more than a summary
+        source = data_source_key(file_path, columns)
+
+        if input.time_series():
+            window = None if input.window_kind() == 'Expanding' else input.window()
+            window_values = [values[0], input.time_col(), aggregators, list(input.window_operations()), window,
+                             input.resample()]
+            cache_key = cache.key('window', source, *window_values)
+            data_frame.set(cache.get_or_compute(cache_key, lambda: create_window_df(original_df(), *window_values)))
+
+            return RoundedDataGrid(
+                data_frame(),
+                decimals=2,
+                row_selection_mode='multiple',
+                width='100%',
+                height='100%',
+            )
+
+        if input.approximate():
+            # A cleared or non-positive sample size falls back to the default
+            size = input.sample_size()
+            size = int(size) if size is not None and size >= 1 else sample_size
+            cache_key = cache.key('summary', source, *values, 'approximate', size)
+            selected_df = cache.get_or_compute(cache_key, lambda: create_approx_summary_df(
+                original_df(), values[0], values[1], values[2], values[3], sample_size=size))
+        else:
+            cache_key = cache.key('summary', source, *values)
+            selected_df = cache.get_or_compute(cache_key, lambda: create_summary_df(
+                original_df(), values[0], values[1], values[2], values[3]))
+
+        if input.bootstrap():
+            numeric = [col for col in aggregators if pd.api.types.is_numeric_dtype(original_df()[col])]
+            cache_key = cache.key('bootstrap', source, values[0], numeric, resamples, confidence)
+            intervals = cache.get_or_compute(cache_key, lambda: bootstrap_group_means(
+                original_df(), values[0], numeric, resamples, confidence))
+            selected_df = selected_df.merge(intervals, on=values[0])
 
         data_frame.set(selected_df)
 
-        return render.DataGrid(
-            data_frame().round(2),
+        return RoundedDataGrid(
+            data_frame(),
+            decimals=2,
             row_selection_mode='multiple',
             width='100%',
             height='100%',
@@ -106,14 +177,22 @@ def load_summary_data(input: Inputs, output: Outputs, session: Session, original
 
 
 @module.server
-def filter_df(input: Inputs, output: Outputs, session: Session, original_df, data_frame):
+def filter_df(input: Inputs, output: Outputs, session: Session, data_source, data_frame):
     @reactive.Calc
     def filtered():
         selected_idx = list(req(input.data_selected_rows()))
         selection = data_frame()[input.group_by()][selected_idx]
 
+        if input.time_series():
+            # Every period of the selected groups, from the windowed summary
+            panel = data_frame()
+            return panel[panel[input.group_by()].isin(selection)]
+
+        # The plotted columns are read on their own, as the x-axis may not be among the summarized columns
+        plot_df = read_data_columns(data_source(), (input.group_by(), input.x_ax(), input.y_ax()))
+
         # Filter data for selected countries
-        return original_df()[original_df()[input.group_by()].isin(selection)]
+        return plot_df[plot_df[input.group_by()].isin(selection)]
 
     return filtered
 
@@ -124,6 +203,9 @@ def create_graph(input: Inputs, output: Outputs, session: Session, filtered_df):
     @render_widget
     @reactive.event(input.plot)
     def graph():
+        import plotly.express as px
+        import plotly.graph_objs as go
+
         # Create the plot
         fig = px.line(
             filtered_df(),
@@ -140,3 +222,18 @@ def create_graph(input: Inputs, output: Outputs, session: Session, filtered_df):
             widget.layout.height = height
 
         return widget
+
+
+@module.server
+def export_summary(input: Inputs, output: Outputs, session: Session, data_frame, filtered_df):
+    @session.download(filename=lambda: export_filename(f'{input.group_by()} summary', input.export_format()),
+                      media_type=lambda: export_media_type(input.export_format()))
+    async def download_summary():
+        async for chunk in stream_export(data_frame(), input.export_format()):
+            yield chunk
+
+    @session.download(filename=lambda: export_filename(f'{input.group_by()} selection', input.export_format()),
+                      media_type=lambda: export_media_type(input.export_format()))
+    async def download_filtered():
+        async for chunk in stream_export(filtered_df(), input.export_format()):
+            yield chunk
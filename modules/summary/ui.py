@@ -1,8 +1,14 @@
 from shiny import module, ui
 from config import Config
+from export import available_formats
 
 operations = Config.input_config('summary')['operations']
 fallback = Config.input_config('summary')['fallback']
+sample_size = Config.input_config('summary')['sample_size']
+window_operations = Config.input_config('summary')['window_operations']
+window_kinds = Config.input_config('summary')['window_kinds']
+window = Config.input_config('summary')['window']
+resample = Config.input_config('summary')['resample']
 
 @module.ui
 def summary_inputs():
@@ -15,8 +21,35 @@ def summary_inputs():
                                  ),
                                  ui.input_selectize('group_by', f'Group By', []),
                                  ui.input_selectize('aggregator', f'Aggregate By', [], multiple=True),
-                                 ui.input_selectize('operations', f'Operations', operations, multiple=True),
-                                 ui.input_selectize('fallbacks', f'Fallback Operations', fallback, multiple=True),
+                                 # The time series mode has operations of its own, and is neither sampled nor
+                                 # bootstrapped
+                                 ui.panel_conditional('!input.time_series',
+                                                      ui.input_selectize('operations', f'Operations', operations,
+                                                                         multiple=True),
+                                                      ui.input_selectize('fallbacks', f'Fallback Operations', fallback,
+                                                                         multiple=True),
+                                                      ui.input_checkbox('approximate', 'Approximate'),
+                                                      ui.panel_conditional('input.approximate',
+                                                                           ui.input_numeric('sample_size',
+                                                                                            'Sample Size per Group',
+                                                                                            value=sample_size, min=1)),
+                                                      ui.input_checkbox('bootstrap', 'Bootstrap Mean Intervals')),
+                                 ui.input_checkbox('time_series', 'Time Series'),
+                                 ui.panel_conditional('input.time_series',
+                                                      ui.input_selectize('time_col', 'Time Column', []),
+                                                      ui.input_radio_buttons('window_kind', 'Window', window_kinds,
+                                                                             inline=True),
+                                                      ui.panel_conditional(
+                                                          "input.window_kind === 'Rolling'",
+                                                          ui.input_numeric('window', 'Periods per Window',
+                                                                           value=window, min=1)),
+                                                      ui.input_numeric('resample', 'Resample Period', value=resample,
+                                                                       min=1),
+                                                      ui.p('The time column must be numeric, e.g. a year.'),
+                                                      ui.input_selectize('window_operations', 'Window Operations',
+                                                                         window_operations,
+                                                                         selected=window_operations[0],
+                                                                         multiple=True)),
                                  ui.input_action_button('submit', 'Summarize'),
                                  ui.panel_conditional(
                                      'input.submit',
@@ -27,8 +60,15 @@ def summary_inputs():
                                      ui.row(
                                          ui.column(12, ui.input_action_button('plot', 'Plot Graph'),
                                                    style='display:inline-block')
+                                     ),
+                                     ui.hr(),
+                                     ui.input_select('export_format', 'Export Format', available_formats()),
+                                     ui.row(
+                                         ui.column(6, ui.download_button('download_summary', 'Download Summary')),
+                                         ui.column(6, ui.panel_conditional(
+                                             'input.data_selected_rows && input.data_selected_rows.length > 0',
+                                             ui.download_button('download_filtered', 'Download Selected Rows')))
                                      )
-
                                  )
                                  )
             )
@@ -0,0 +1,235 @@
+"""
+Multivariate distributions of the Distributions tab: multivariate normal, Dirichlet and multinomial.
+
+Everything is batched over the observations. Multivariate normal samples are drawn as Z @ L.T + mean, with the
+Cholesky factor L of the covariance computed once per covariance matrix and memoised, and the log-density of all
+observations costs one triangular solve with the same factor. Dirichlet and multinomial log-densities are single
+array expressions over all observations. Pairwise plots are binned into 2-D histograms here, so only the bin counts,
+not the sample, are sent to the browser.
+"""
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def parse_vector(text: str) -> tuple[float, ...]:
+    """
+    Parse a vector typed in the parameter editor, e.g. "0, 1.5, 2"
+    :param text: comma or space separated numbers
+    :return:
+    """
+    try:
+        vector = tuple(float(value) for value in text.replace(',', ' ').split())
+    except ValueError:
+        raise ValueError(f'"{text}" is not a list of numbers') from None
+
+    if not vector:
+        raise ValueError('The vector is empty')
+
+    return vector
+
+
+def parse_matrix(text: str) -> tuple[tuple[float, ...], ...]:
+    """
+    Parse a matrix typed in the parameter editor, rows separated by semicolons or new lines, e.g. "1, 0.5; 0.5, 1"
+    :param text: rows of comma or space separated numbers
+    :return:
+    """
+    matrix = tuple(parse_vector(row) for row in text.replace('\n', ';').split(';') if row.strip())
+
+    if not matrix or any(len(row) != len(matrix) for row in matrix):
+        raise ValueError('The matrix must be square')
+
+    return matrix
+
+
+@lru_cache(maxsize=64)
+def cholesky_factor(covariance: tuple[tuple[float, ...], ...]) -> np.ndarray:
+    """
+    Lower triangular Cholesky factor of a covariance matrix, computed once per matrix
+    :param covariance: symmetric positive definite matrix, as returned by `parse_matrix`
+    :return:
+    """
+    import numpy as np
+
+    cov = np.array(covariance, dtype=np.float64)
+
+    if not np.allclose(cov, cov.T):
+        raise ValueError('The covariance matrix must be symmetric')
+
+    try:
+        factor = np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        raise ValueError('The covariance matrix must be positive definite') from None
+
+    # The memoised array is shared by every caller
+    factor.flags.writeable = False
+
+    return factor
+
+
+def _check_dimensions(name: str, size: int, expected: int):
+    if size != expected:
+        raise ValueError(f'{name} has {size} entries, expected {expected}')
+
+
+def mvn_sample(mean: tuple, covariance: tuple, size: int, random_state: int = None) -> np.ndarray:
+    import numpy as np
+
+    _check_dimensions('The mean vector', len(mean), len(covariance))
+    factor = cholesky_factor(covariance)
+    z = np.random.default_rng(random_state).standard_normal((size, len(mean)))
+
+    return z @ factor.T + np.asarray(mean)
+
+
+def mvn_logpdf(x: np.ndarray, mean: tuple, covariance: tuple) -> np.ndarray:
+    import numpy as np
+    from scipy.linalg import solve_triangular
+
+    factor = cholesky_factor(covariance)
+    # Solving L y = x - mean for all observations at once gives the Mahalanobis distances as |y|^2
+    y = solve_triangular(factor, (x - np.asarray(mean)).T, lower=True, check_finite=False)
+    log_det = 2 * np.log(np.diag(factor)).sum()
+
+    return -0.5 * ((y * y).sum(axis=0) + log_det + len(mean) * math.log(2 * math.pi))
+
+
+def dirichlet_sample(alpha: tuple, size: int, random_state: int = None) -> np.ndarray:
+    import numpy as np
+
+    if min(alpha) <= 0:
+        raise ValueError('The concentration parameters must be positive')
+
+    gamma = np.random.default_rng(random_state).standard_gamma(alpha, size=(size, len(alpha)))
+
+    return gamma / gamma.sum(axis=1, keepdims=True)
+
+
+def dirichlet_logpdf(x: np.ndarray, alpha: tuple) -> np.ndarray:
+    import numpy as np
+    from scipy.special import gammaln
+
+    alpha = np.asarray(alpha)
+    log_norm = gammaln(alpha.sum()) - gammaln(alpha).sum()
+
+    with np.errstate(divide='ignore'):
+        return log_norm + ((alpha - 1) * np.log(x)).sum(axis=1)
+
+
+def multinomial_sample(trials: int, probabilities: tuple, size: int, random_state: int = None) -> np.ndarray:
+    import numpy as np
+
+    if min(probabilities) < 0 or not math.isclose(sum(probabilities), 1):
+        raise ValueError('The probabilities must be non-negative and sum to 1')
+
+    return np.random.default_rng(random_state).multinomial(int(trials), probabilities, size=size).astype(np.float64)
+
+
+def multinomial_logpmf(x: np.ndarray, trials: int, probabilities: tuple) -> np.ndarray:
+    import numpy as np
+    from scipy.special import gammaln, xlogy
+
+    return gammaln(trials + 1) + (xlogy(x, np.asarray(probabilities)) - gammaln(x + 1)).sum(axis=1)
+
+
+def multivariate_stats(dist_name: str, params: dict) -> dict:
+    """
+    Closed form component means and variances, and the entropy, of a multivariate distribution
+    :param dist_name: scipy.stats distribution name
+    :param params: parameters, as passed to `create_multivariate_df`
+    :return:
+    """
+    import numpy as np
+    import scipy.stats
+
+    if dist_name == 'multivariate_normal':
+        mean, variance = np.asarray(params['mean']), np.diag(params['cov'])
+        entropy = scipy.stats.multivariate_normal(params['mean'], params['cov']).entropy()
+    elif dist_name == 'dirichlet':
+        alpha = np.asarray(params['alpha'])
+        total = alpha.sum()
+        mean, variance = alpha / total, alpha * (total - alpha) / (total ** 2 * (total + 1))
+        entropy = scipy.stats.dirichlet(alpha).entropy()
+    else:
+        p = np.asarray(params['p'])
+        mean, variance = params['n'] * p, params['n'] * p * (1 - p)
+        entropy = scipy.stats.multinomial(params['n'], p).entropy()
+
+    return {
+        'mean': [round(float(v), 4) for v in mean],
+        'variance': [round(float(v), 4) for v in variance],
+        'entropy': round(float(entropy), 4)
+    }
+
+
+def create_multivariate_df(dist_name: str, dist_size: int, dist_params: dict, random_state: int = None) -> dict:
+    """
+    Sample a multivariate distribution and evaluate the density of every observation
+    :param dist_name: 'multivariate_normal' ({'mean', 'cov'}), 'dirichlet' ({'alpha'}) or 'multinomial' ({'n', 'p'})
+    :param dist_size: number of observations
+    :param dist_params: parameters, as tuples from `parse_vector` and `parse_matrix`
+    :param random_state: seed of the sampling
+    :return: same keys as `utils.create_distribution_df`; the distribution array has one row per component followed
+        by the density and the log-density
+    """
+    import numpy as np
+    import pandas as pd
+
+    if dist_name == 'multivariate_normal':
+        observations = mvn_sample(dist_params['mean'], dist_params['cov'], dist_size, random_state)
+        log_density = mvn_logpdf(observations, dist_params['mean'], dist_params['cov'])
+    elif dist_name == 'dirichlet':
+        observations = dirichlet_sample(dist_params['alpha'], dist_size, random_state)
+        log_density = dirichlet_logpdf(observations, dist_params['alpha'])
+    elif dist_name == 'multinomial':
+        observations = multinomial_sample(dist_params['n'], dist_params['p'], dist_size, random_state)
+        log_density = multinomial_logpmf(observations, dist_params['n'], dist_params['p'])
+    else:
+        raise ValueError(f'"{dist_name}" is not a supported multivariate distribution')
+
+    dist_array = np.vstack((observations.T, np.exp(log_density), log_density))
+    columns = [f'Observations {i + 1}' for i in range(observations.shape[1])] + ['Density', 'Log Density']
+
+    return {
+        'distribution_array': dist_array,
+        'distribution_df': pd.DataFrame(dist_array.T, columns=columns),
+        'stats': multivariate_stats(dist_name, dist_params),
+        'parameters': None
+    }
+
+
+def pairwise_histograms(observations: np.ndarray, bins: int = 50) -> dict:
+    """
+    Bin every pair of components into a 2-D histogram, and every component into a 1-D histogram
+    :param observations: (observations, components) array
+    :param bins: number of bins per component
+    :return: {'edges': [bin edges per component], (i, i): 1-D counts of component i, (i, j): 2-D counts of component i
+        (y) against component j (x), indexed [i bin, j bin] as plotly heatmaps expect}
+    """
+    import numpy as np
+
+    # Discrete components get one bin per value when that takes fewer bins
+    edges = []
+    for column in observations.T:
+        low, high = column.min(), column.max()
+        if np.all(column == np.round(column)) and high - low < bins:
+            edges.append(np.arange(low - 0.5, high + 1.5))
+        else:
+            edges.append(np.linspace(low, high if high > low else low + 1, bins + 1))
+
+    histograms = {'edges': edges}
+    dims = observations.shape[1]
+
+    for i in range(dims):
+        histograms[i, i] = np.histogram(observations[:, i], bins=edges[i])[0]
+        for j in range(i + 1, dims):
+            counts = np.histogram2d(observations[:, i], observations[:, j], bins=(edges[i], edges[j]))[0]
+            histograms[i, j], histograms[j, i] = counts, counts.T
+
+    return histograms
@@ -0,0 +1,143 @@
+"""
+Serialisation of the tables sent to the browser.
+
+shiny's DataGrid payload is built with `json.loads(df.to_json(orient='split'))`, i.e. the frame is encoded to a JSON
+string and parsed back into Python lists, and the app used to round a full copy of the frame before that. Here the
+payload is built column by column instead: numeric columns are rounded straight from their NumPy buffers and turned
+into Python lists in C (`ndarray.tolist`), and only the other columns (strings, dates, ...) go through pandas' JSON
+encoder, so they come out exactly as before. Column encoders are looked up by NumPy dtype kind in `column_encoders`,
+and the whole encoder can be switched back to shiny's with the `grid_serializer` server setting.
+
+Figures are not handled here: the app sends them as `FigureWidget`s, whose NumPy arrays already travel through the
+widget comm as binary buffers, without going through `plotly.io`'s JSON encoder.
+
+Run `python serialization.py` to benchmark the encoders on 10^5 and 10^6 row frames.
+"""
+from __future__ import annotations
+
+import copy
+import json
+from typing import TYPE_CHECKING, Any, Callable
+
+from shiny import render
+
+from config import Config
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+def _encode_float(values: np.ndarray, decimals: int | None) -> list:
+    import numpy as np
+
+    if decimals is not None:
+        values = np.round(values, decimals)
+
+    missing = ~np.isfinite(values)
+    if missing.any():
+        # JSON has no NaN nor infinity, pandas encodes both as null
+        return np.where(missing, None, values).tolist()
+
+    return values.tolist()
+
+
+def _encode_exact(values: np.ndarray, decimals: int | None) -> list:
+    return values.tolist()
+
+
+# NumPy dtype kind -> function(values, decimals) returning a JSON-ready list
+column_encoders: dict[str, Callable[[Any, int | None], list]] = {
+    'f': _encode_float,
+    'i': _encode_exact,
+    'u': _encode_exact,
+    'b': _encode_exact
+}
+
+
+def _encode_column(column: pd.Series, decimals: int | None) -> list:
+    import numpy as np
+
+    # Extension dtypes (strings, categories, nullable integers, ...) are left to pandas
+    encoder = column_encoders.get(column.dtype.kind) if isinstance(column.dtype, np.dtype) else None
+    if encoder is None:
+        return json.loads(column.to_json(orient='values'))
+
+    return encoder(column.to_numpy(), decimals)
+
+
+def encode_frame(data_frame: pd.DataFrame, decimals: int = None) -> dict[str, list]:
+    """
+    Encode the index and data of a frame as in `DataFrame.to_json(orient='split')`, without building the JSON string
+    :param data_frame: frame to encode
+    :param decimals: number of decimals numeric columns are rounded to, as with `DataFrame.round`
+    :return: {'index': [...], 'data': [[row], ...]}
+    """
+    import pandas as pd
+
+    columns = [_encode_column(data_frame.iloc[:, i], decimals) for i in range(data_frame.shape[1])]
+
+    if isinstance(data_frame.index, pd.RangeIndex):
+        index = list(data_frame.index)
+    else:
+        index = _encode_column(data_frame.index.to_series(), None)
+
+    return {'index': index, 'data': list(map(list, zip(*columns)))}
+
+
+class RoundedDataGrid(render.DataGrid):
+    """
+    `render.DataGrid` that rounds numeric columns while encoding, instead of on a copy of the frame
+    """
+
+    def __init__(self, data: pd.DataFrame, decimals: int = None, **kwargs):
+        super().__init__(data, **kwargs)
+        self.decimals = decimals
+
+    def to_payload(self) -> object:
+        if Config.server_config('grid_serializer') != 'numpy':
+            skeleton = copy.copy(self)
+            skeleton.data = self.data.round(self.decimals) if self.decimals is not None else self.data
+            return render.DataGrid.to_payload(skeleton)
+
+        # The columns, type hints and options still come from shiny, from an empty frame
+        skeleton = copy.copy(self)
+        skeleton.data = self.data.iloc[:0]
+        payload = render.DataGrid.to_payload(skeleton)
+        payload.update(encode_frame(self.data, self.decimals))
+
+        return payload
+
+
+def main():
+    import timeit
+
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+
+    for rows in (10 ** 5, 10 ** 6):
+        frame = pd.DataFrame(rng.random((rows, 5)), columns=['Observations', 'PDF', 'CDF', 'SF', 'ISF'])
+        frame['Group'] = rng.choice(['Afghanistan', 'Albania', 'Algeria'], rows)
+        frame.loc[::1000, 'SF'] = np.nan
+        frame.loc[1::1000, 'PDF'] = np.inf
+        frame.loc[2::1000, 'PDF'] = -np.inf
+
+        shiny_grid = render.DataGrid(frame)
+        rounded_grid = RoundedDataGrid(frame, decimals=3)
+
+        def shiny_payload():
+            skeleton = copy.copy(shiny_grid)
+            skeleton.data = frame.round(3)
+            return render.DataGrid.to_payload(skeleton)
+
+        assert shiny_payload()['data'] == rounded_grid.to_payload()['data']
+
+        for name, build in [('round + to_json + loads', shiny_payload), ('encode_frame', rounded_grid.to_payload)]:
+            seconds = min(timeit.repeat(build, number=1, repeat=3))
+            print(f'{rows:>9,} rows  {name:<24} {seconds * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+Estimators used by the approximate summary mode. Every estimator works on all groups at once: values are passed as
+flat arrays together with an integer group code per value, so no Python loop runs per group.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def stratified_sample(group_codes: np.ndarray, sample_size: int, random_state: int = None,
+                      population: np.ndarray = None) -> np.ndarray:
+    """
+    Draw a stratified Bernoulli sample: every row of a group is kept independently with probability
+    sample_size / group size, so each group contributes about `sample_size` rows (all of them if it is smaller).
+    Rows of groups larger than `sample_size` are not visited one by one: positions are drawn at the rate of the
+    smallest of these groups with geometric gaps, then thinned per group, so the cost grows with the sample and not
+    with the data. Rows of the other groups are all kept.
+    :param group_codes: integer group code per row
+    :param sample_size: expected number of rows kept per group
+    :param random_state: seed of the random generator
+    :param population: number of rows of every group, counted from `group_codes` if not given
+    :return: sorted positions of the sampled rows
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(random_state)
+
+    if population is None:
+        population = np.bincount(group_codes)
+
+    large = population > sample_size
+    if not large.any():
+        return np.arange(len(group_codes))
+
+    parts = []
+    if not large.all():
+        parts.append(np.flatnonzero(~large[group_codes]))
+
+    rate = sample_size / population[large].min()
+    # Bernoulli(rate) positions: gaps between kept rows are geometric; a few more gaps than expected are drawn
+    expected = len(group_codes) * rate
+    gaps = rng.geometric(rate, int(expected + 6 * np.sqrt(expected) + 16))
+    positions = np.cumsum(gaps) - 1
+    while positions[-1] < len(group_codes) - 1:
+        more = np.cumsum(rng.geometric(rate, len(gaps))) + positions[-1]
+        positions = np.concatenate([positions, more])
+    positions = positions[positions < len(group_codes)]
+
+    # Thinning to sample_size / group size overall
+    codes = group_codes[positions]
+    keep_probability = np.where(large, sample_size / np.maximum(population, 1) / rate, 0)
+    parts.append(positions[rng.random(len(positions)) < keep_probability[codes]])
+
+    return np.sort(np.concatenate(parts))
+
+
+def sample_mean(values: np.ndarray, group_codes: np.ndarray, n_groups: int, population: np.ndarray,
+                z: float = 1.96) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Estimate the mean of every group from a sample, with a normal-approximation error bound that includes the finite
+    population correction (the bound is 0 for a group that was sampled in full)
+    :param values: sampled values
+    :param group_codes: group code of every sampled value, in range(n_groups)
+    :param n_groups: number of groups
+    :param population: number of rows of every group in the full data
+    :param z: standard score of the confidence level, 1.96 for 95%
+    :return: (estimates, error bounds)
+    """
+    import numpy as np
+
+    n = np.bincount(group_codes, minlength=n_groups)
+    total = np.bincount(group_codes, weights=values, minlength=n_groups)
+    total_sq = np.bincount(group_codes, weights=values ** 2, minlength=n_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        variance = np.maximum(total_sq - n * mean ** 2, 0) / (n - 1)
+        fpc = np.sqrt(np.clip((population - n) / np.maximum(population - 1, 1), 0, 1))
+        error = z * np.sqrt(variance / n) * fpc
+
+    return mean, np.where(n < population, error, 0)
+
+
+def sample_quantile(values: np.ndarray, group_codes: np.ndarray, n_groups: int, population: np.ndarray, q: float,
+                    z: float = 1.96) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Estimate the `q` quantile of every group from a sample. The error bound is half the width of the distribution-free
+    confidence interval given by the order statistics at ranks n * (q -/+ z * sqrt(q * (1 - q) / n)).
+    :param values: sampled values
+    :param group_codes: group code of every sampled value, in range(n_groups)
+    :param n_groups: number of groups
+    :param population: number of rows of every group in the full data
+    :param q: quantile to estimate, 0.5 for the median
+    :param z: standard score of the confidence level, 1.96 for 95%
+    :return: (estimates, error bounds)
+    """
+    import numpy as np
+
+    order = np.lexsort((values, group_codes))
+    sorted_values = values[order]
+
+    n = np.bincount(group_codes, minlength=n_groups)
+    # Groups the sample missed get no estimate
+    missed = n == 0
+    if missed.all():
+        return np.full(n_groups, np.nan), np.full(n_groups, np.nan)
+
+    starts = np.minimum(np.r_[0, np.cumsum(n)[:-1]], len(sorted_values) - 1)
+    n = np.maximum(n, 1)
+    last = n - 1
+
+    def at_rank(p):
+        # Linear interpolation between the closest ranks, same as pandas' default quantile
+        position = np.clip(p, 0, 1) * last
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, last)
+        frac = position - low
+        lower, upper = sorted_values[starts + low], sorted_values[starts + high]
+
+        return lower + (upper - lower) * frac
+
+    spread = z * np.sqrt(q * (1 - q) / n)
+    estimate = at_rank(np.full(n_groups, q))
+    error = np.where(n < population, (at_rank(q + spread) - at_rank(q - spread)) / 2, 0)
+
+    estimate[missed] = np.nan
+    error[missed] = np.nan
+
+    return estimate, error
+
+
+def hyperloglog_nunique(hashes: np.ndarray, group_codes: np.ndarray, n_groups: int, precision: int = 12,
+                        z: float = 1.96) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Estimate the number of distinct values of every group with a HyperLogLog sketch of 2 ** `precision` one-byte
+    registers per group. Unlike a sample, the sketch sees every row, so its relative standard error of
+    1.04 / sqrt(2 ** precision) (1.6% for the default precision) does not depend on the group size. Groups with fewer
+    rows than registers are counted exactly instead, which is both cheaper and exact (error bound 0).
+    :param hashes: 64-bit hash of every value, e.g. from `pandas.util.hash_pandas_object`
+    :param group_codes: group code of every value, in range(n_groups)
+    :param n_groups: number of groups
+    :param precision: number of hash bits used to select a register
+    :param z: standard score of the confidence level, 1.96 for 95%
+    :return: (estimates, error bounds)
+    """
+    import numpy as np
+
+    m = 1 << precision
+    hashes = hashes.astype(np.uint64, copy=False)
+    group_codes = group_codes.astype(np.int64, copy=False)
+
+    population = np.bincount(group_codes, minlength=n_groups)
+    sketched = population >= m
+    estimate = np.zeros(n_groups)
+    error = np.zeros(n_groups)
+
+    if not sketched.all():
+        rows = np.flatnonzero(~sketched[group_codes])
+        codes, values = group_codes[rows], hashes[rows]
+        order = np.lexsort((values, codes))
+        codes, values = codes[order], values[order]
+        new = np.r_[True, (codes[1:] != codes[:-1]) | (values[1:] != values[:-1])]
+        estimate += np.bincount(codes[new], minlength=n_groups)
+
+    if not sketched.any():
+        return estimate, error
+
+    # Sketched groups get consecutive register blocks
+    block = np.cumsum(sketched) - 1
+    rows = np.flatnonzero(sketched[group_codes]) if not sketched.all() else slice(None)
+    values, codes = hashes[rows], block[group_codes[rows]]
+
+    register = (values >> np.uint64(64 - precision)).astype(np.int64)
+    rest = values & np.uint64((1 << (64 - precision)) - 1)
+    # Position of the leftmost 1-bit in the remaining 64 - precision bits
+    rank = ((64 - precision) - _bit_length(rest) + 1).astype(np.uint8)
+
+    registers = np.zeros(sketched.sum() * m, dtype=np.uint8)
+    np.maximum.at(registers, codes * m + register, rank)
+    registers = registers.reshape(-1, m)
+
+    alpha = 0.7213 / (1 + 1.079 / m)
+    sketch = alpha * m ** 2 / np.exp2(-registers.astype(np.float64)).sum(axis=1)
+
+    # Small range correction: linear counting while some registers are still empty
+    zeros = (registers == 0).sum(axis=1)
+    small = (sketch <= 2.5 * m) & (zeros > 0)
+    with np.errstate(divide='ignore'):
+        sketch[small] = m * np.log(m / zeros[small])
+
+    estimate[sketched] = sketch
+    error[sketched] = z * 1.04 / np.sqrt(m) * sketch
+
+    return estimate, error
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    import numpy as np
+
+    if x.max(initial=0) < 2 ** 53:
+        # Exact in float64, whose exponent is then the bit length
+        return np.frexp(x.astype(np.float64))[1].astype(np.int64)
+
+    length = np.zeros(x.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        over = x >= (np.uint64(1) << np.uint64(shift))
+        length[over] += shift
+        x = np.where(over, x >> np.uint64(shift), x)
+
+    return length + (x > 0)
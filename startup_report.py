@@ -0,0 +1,62 @@
+"""
+Report where the app's cold-start time goes, based on the interpreter's `-X importtime` output.
+
+The import is run in a fresh interpreter with the background warm-up disabled, so that only the imports needed to
+serve the first page are measured.
+
+Usage: python startup_report.py [--module app] [--top 15]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'plotly', 'pyarrow']
+
+line_re = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure_imports(module: str) -> list[tuple[str, int, int, int]]:
+    """
+    Import `module` in a fresh interpreter and return its `-X importtime` records
+    :param module: module to import e.g. 'app'
+    :return: list of (module name, depth, self time in us, cumulative time in us)
+    """
+    env = dict(os.environ, STATS_SHOWCASE_WARM_UP='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            capture_output=True, text=True, check=True)
+
+    records = []
+    for line in result.stderr.splitlines():
+        match = line_re.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start import time report')
+    parser.add_argument('--module', default='app', help='module to import (default: app)')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    records = measure_imports(args.module)
+    imported = {name for name, *_ in records}
+    total = next(cumulative for name, depth, _, cumulative in records if name == args.module and depth == 0)
+
+    print(f'Importing "{args.module}" took {total / 1000:.1f} ms')
+    print(f'Heavy modules loaded at startup: '
+          f'{", ".join(m for m in HEAVY_MODULES if m in imported) or "none"}')
+    print(f'\nSlowest direct imports:')
+
+    direct = sorted([r for r in records if r[1] == 1], key=lambda r: r[3], reverse=True)
+    for name, _, _, cumulative in direct[:args.top]:
+        print(f'{cumulative / 1000:10.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
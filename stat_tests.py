@@ -0,0 +1,335 @@
+"""
+Batch hypothesis testing across the groups of a data set.
+
+Every test in `Config`'s `statistical_testing` section is run for every value column and, except for ANOVA which
+compares all groups at once, for every pair of groups. t-tests, z-tests and ANOVA only need per-group counts, means
+and variances, so they are computed for all column x group pair combinations with a handful of array operations.
+The Wilcoxon rank-sum test needs the raw values of both groups; it ranks batches of padded group pairs across all
+columns at once, and the batches are fanned out over worker processes when the data set is wide. The worker pool is
+started once, on first use, and kept for the life of the app; its processes are spawned rather than forked, so they do
+not inherit the app's threads (catalogue watcher, warm-up, memory sweep) or its open connections.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from cache import get_result_cache
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Above this many group pairs x values, the Wilcoxon tests are spread over worker processes
+PARALLEL_THRESHOLD = 5_000_000
+# Maximum number of elements of the padded arrays the Wilcoxon tests are computed on at once
+BATCH_SIZE = 2_000_000
+
+result_columns = ['test', 'column', 'group_a', 'group_b', 'statistic', 'p_value', 'p_adjusted', 'significant']
+
+_worker_pool: ProcessPoolExecutor | None = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> ProcessPoolExecutor:
+    """
+    Return the pool of worker processes of the Wilcoxon tests, one per core, starting it on first use
+    :return:
+    """
+    global _worker_pool
+
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                               mp_context=multiprocessing.get_context('spawn'))
+
+    return _worker_pool
+
+
+def run_group_tests(data_frame: pd.DataFrame, group_by: str, columns: list[str] | tuple[str], tests: list[str],
+                    correction: str = 'holm', alpha: float = 0.05, workers: int = None,
+                    source: tuple = None) -> pd.DataFrame:
+    """
+    Run `tests` on every column of `columns` across the groups defined by `group_by`. Results are cached by the
+    source of the data set, or its content if no source is given, and the test settings.
+    :param data_frame: DataFrame with the group column and the value columns
+    :param group_by: column defining the groups
+    :param columns: numeric columns to test
+    :param tests: tests to run, any of 't-test', 'z-test', 'Wilcoxon' and 'ANOVA'
+    :param correction: multiple comparison correction applied within each test: 'holm', 'bonferroni', 'fdr_bh' or
+    'none'
+    :param alpha: significance level
+    :param workers: number of worker processes for the Wilcoxon tests, defaults to the number of cores
+    :param source: identity of `data_frame`, e.g. from `utils.data_source_key`
+    :return: one row per test, column and group pair
+    """
+    cache = get_result_cache()
+    data = source if source is not None else data_frame[[group_by, *columns]]
+    key = cache.key('tests', data, group_by, list(columns), list(tests), correction, alpha)
+
+    return cache.get_or_compute(key, lambda: _run_group_tests(data_frame, group_by, list(columns), list(tests),
+                                                              correction, alpha, workers))
+
+
+def _run_group_tests(data_frame, group_by, columns, tests, correction, alpha, workers):
+    import numpy as np
+    import pandas as pd
+
+    grouped = data_frame.groupby(group_by)[columns]
+    stats = grouped.agg(['count', 'mean', 'var'])
+    groups = stats.index.to_numpy()
+
+    # (groups, columns) arrays
+    n = stats.xs('count', axis=1, level=1).to_numpy(dtype=np.float64)
+    mean = stats.xs('mean', axis=1, level=1).to_numpy(dtype=np.float64)
+    var = stats.xs('var', axis=1, level=1).to_numpy(dtype=np.float64)
+
+    pair_a, pair_b = np.triu_indices(len(groups), 1)
+    results = []
+
+    for test in tests:
+        if test == 'ANOVA':
+            statistic, p_value = anova(n, mean, var)
+            result = pd.DataFrame({'column': columns, 'group_a': 'all', 'group_b': 'all'})
+        else:
+            if test == 't-test':
+                statistic, p_value = welch_t_test(n[pair_a], mean[pair_a], var[pair_a],
+                                                  n[pair_b], mean[pair_b], var[pair_b])
+            elif test == 'z-test':
+                statistic, p_value = z_test(n[pair_a], mean[pair_a], var[pair_a],
+                                            n[pair_b], mean[pair_b], var[pair_b])
+            elif test == 'Wilcoxon':
+                # One conversion of the columns, then a cheap numpy gather per group
+                positions = grouped.indices
+                matrix = data_frame[columns].to_numpy(dtype=np.float64)
+                values = [matrix[positions[group]] for group in groups]
+                statistic, p_value = rank_sum_test(values, pair_a, pair_b, workers)
+            else:
+                raise ValueError(f'"{test}" is not a supported test')
+
+            # Pair-major, column-minor order, same as the flattened (pairs, columns) arrays
+            result = pd.DataFrame({'column': np.tile(columns, len(pair_a)),
+                                   'group_a': np.repeat(groups[pair_a], len(columns)),
+                                   'group_b': np.repeat(groups[pair_b], len(columns))})
+
+        result.insert(0, 'test', test)
+        result['statistic'] = np.ravel(statistic)
+        result['p_value'] = np.ravel(p_value)
+        result['p_adjusted'] = adjust_p_values(result['p_value'].to_numpy(), correction)
+        result['significant'] = result['p_adjusted'] < alpha
+        results.append(result)
+
+    if not results:
+        return pd.DataFrame(columns=result_columns)
+
+    return pd.concat(results, ignore_index=True)[result_columns]
+
+
+def welch_t_test(n_a, mean_a, var_a, n_b, mean_b, var_b) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided Welch's t-test from group counts, means and variances, for arrays of any matching shape
+    :return: (t statistics, p values)
+    """
+    import numpy as np
+    from scipy import stats
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        se_a, se_b = var_a / n_a, var_b / n_b
+        statistic = (mean_a - mean_b) / np.sqrt(se_a + se_b)
+        dof = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+
+    return statistic, 2 * stats.t.sf(np.abs(statistic), dof)
+
+
+def z_test(n_a, mean_a, var_a, n_b, mean_b, var_b) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided two-sample z-test using the sample variances, for arrays of any matching shape
+    :return: (z statistics, p values)
+    """
+    import numpy as np
+    from scipy import stats
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        statistic = (mean_a - mean_b) / np.sqrt(var_a / n_a + var_b / n_b)
+
+    return statistic, 2 * stats.norm.sf(np.abs(statistic))
+
+
+def anova(n, mean, var) -> tuple[np.ndarray, np.ndarray]:
+    """
+    One-way ANOVA of every column from its (groups, columns) counts, means and variances
+    :return: (F statistics, p values), one per column
+    """
+    import numpy as np
+    from scipy import stats
+
+    present = n > 0
+    mean, var = np.where(present, mean, 0), np.where(n > 1, var, 0)
+
+    total = n.sum(axis=0)
+    n_groups = present.sum(axis=0)
+    grand_mean = (n * mean).sum(axis=0) / total
+
+    between = (n * (mean - grand_mean) ** 2).sum(axis=0)
+    within = ((n - 1).clip(0) * var).sum(axis=0)
+
+    dof_between, dof_within = n_groups - 1, total - n_groups
+    with np.errstate(invalid='ignore', divide='ignore'):
+        statistic = (between / dof_between) / (within / dof_within)
+
+    return statistic, stats.f.sf(statistic, dof_between, dof_within)
+
+
+def rank_sum_test(values: list[np.ndarray], pair_a: np.ndarray, pair_b: np.ndarray,
+                  workers: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided Wilcoxon rank-sum (Mann-Whitney U) test of every group pair, vectorised across pairs and columns.
+    Values must not be missing.
+    :param values: (rows, columns) array of every group
+    :param pair_a: index of the first group of every pair
+    :param pair_b: index of the second group of every pair
+    :param workers: number of chunks spread over the worker processes, defaults to the number of cores
+    :return: (U statistics, p values), each of shape (pairs, columns)
+    """
+    import numpy as np
+
+    lengths = np.array([len(group) for group in values])
+    size = (lengths[pair_a] + lengths[pair_b]).sum() * values[0].shape[1]
+    workers = workers or os.cpu_count() or 1
+
+    if size < PARALLEL_THRESHOLD or workers == 1:
+        statistic, p_value = _rank_sum_chunk(values, pair_a, pair_b)
+    else:
+        chunks = np.array_split(np.arange(len(pair_a)), workers)
+        executor = get_worker_pool()
+        futures = [executor.submit(_rank_sum_chunk, values, pair_a[chunk], pair_b[chunk])
+                   for chunk in chunks if len(chunk)]
+        parts = [future.result() for future in futures]
+
+        statistic = np.concatenate([part[0] for part in parts])
+        p_value = np.concatenate([part[1] for part in parts])
+
+    return statistic, p_value
+
+
+def _rank_sum_chunk(values, pair_a, pair_b):
+    import numpy as np
+
+    n_columns = values[0].shape[1]
+    lengths = np.array([len(group) for group in values])
+    # All groups in one array, so that the samples of a batch of pairs are gathered with a single index
+    stacked = np.concatenate(values)
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    statistic = np.full((len(pair_a), n_columns), np.nan)
+    p_value = np.full((len(pair_a), n_columns), np.nan)
+
+    # Pairs are processed in batches of padded (pairs, rows, columns) arrays of bounded size
+    pair_lengths = lengths[pair_a] + lengths[pair_b]
+    start = 0
+    while start < len(pair_a):
+        padded_size = np.arange(1, len(pair_a) - start + 1) * np.maximum.accumulate(pair_lengths[start:]) * n_columns
+        stop = start + max(1, int(np.searchsorted(padded_size, BATCH_SIZE, side='right')))
+
+        batch = slice(start, stop)
+        statistic[batch], p_value[batch] = _rank_sum_batch(stacked, offsets, lengths, pair_a[batch],
+                                                                pair_b[batch])
+        start = stop
+
+    return statistic, p_value
+
+
+def _rank_sum_batch(stacked, offsets, lengths, pair_a, pair_b):
+    import numpy as np
+    from scipy import stats
+
+    n_a, n_b = lengths[pair_a], lengths[pair_b]
+    total = n_a + n_b
+    width = int(total.max())
+
+    # Both samples of a pair side by side, padded with NaN (sorted last, never ranked): the slot of every value within
+    # its pair, and the row of `stacked` it comes from
+    row = np.repeat(np.arange(len(pair_a)), total)
+    slot = np.arange(total.sum()) - np.repeat(np.cumsum(total) - total, total)
+    first = slot < np.repeat(n_a, total)
+    source = slot + np.where(first, np.repeat(offsets[pair_a], total), np.repeat(offsets[pair_b] - n_a, total))
+
+    # (pairs, columns, rows) arrays: every scan below runs along the last, contiguous axis
+    combined = np.full((len(pair_a), stacked.shape[1], width), np.nan)
+    combined[row, :, slot] = stacked[source]
+
+    order = np.argsort(combined, axis=-1)
+    ordered = np.take_along_axis(combined, order, axis=-1)
+    # The first n_a slots of a pair hold the first sample
+    from_a = order < n_a[:, None, None]
+    valid = ~np.isnan(ordered)
+
+    # Average ranks: every value gets the mean position of its run of ties
+    position = np.arange(width, dtype=np.int32)
+    new_run = np.ones(ordered.shape, dtype=bool)
+    new_run[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    run_end = np.ones(ordered.shape, dtype=bool)
+    run_end[..., :-1] = new_run[..., 1:]
+
+    run_start = np.maximum.accumulate(np.where(new_run, position, 0), axis=-1)
+    run_stop = np.minimum.accumulate(np.where(run_end, position, width)[..., ::-1], axis=-1)[..., ::-1]
+    ties = run_stop - run_start + 1
+
+    # Ranks are 1 + (run_start + run_stop) / 2, summed in integers and halved once
+    ranked_a = valid & from_a
+    rank_sum = np.where(ranked_a, run_start + run_stop, 0).sum(axis=-1) / 2 + ranked_a.sum(axis=-1)
+    # Sum of t^3 - t over the tie runs, counted as t^2 - 1 for each of the t values of a run
+    tie_term = np.where(valid, ties * ties - 1, 0).sum(axis=-1)
+
+    n_a, n_b = n_a[:, None].astype(np.float64), n_b[:, None].astype(np.float64)
+    n = n_a + n_b
+    u_statistic = rank_sum - n_a * (n_a + 1) / 2
+
+    # Normal approximation with tie and continuity correction, as scipy's mannwhitneyu(method='asymptotic')
+    mu = n_a * n_b / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = np.sqrt(n_a * n_b / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (np.maximum(u_statistic, n_a * n_b - u_statistic) - mu - 0.5) / sigma
+
+    return u_statistic, np.clip(2 * stats.norm.sf(z), 0, 1)
+
+
+def adjust_p_values(p_values: np.ndarray, correction: str = 'holm') -> np.ndarray:
+    """
+    Adjust p values for multiple comparisons. Missing p values are ignored and stay missing.
+    :param p_values: p values of one family of tests
+    :param correction: 'holm', 'bonferroni', 'fdr_bh' (Benjamini-Hochberg) or 'none'
+    :return: adjusted p values
+    """
+    import numpy as np
+
+    adjusted = np.full(len(p_values), np.nan)
+    valid = ~np.isnan(p_values)
+    p = p_values[valid]
+    m = len(p)
+
+    if correction == 'none' or m == 0:
+        adjusted[valid] = p
+        return adjusted
+
+    order = np.argsort(p)
+    ranked = p[order]
+
+    if correction == 'bonferroni':
+        result = np.minimum(p * m, 1)
+    elif correction == 'holm':
+        ranked = np.maximum.accumulate(np.minimum(ranked * (m - np.arange(m)), 1))
+        result = np.empty(m)
+        result[order] = ranked
+    elif correction == 'fdr_bh':
+        ranked = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+        result = np.empty(m)
+        result[order] = np.minimum(ranked, 1)
+    else:
+        raise ValueError(f'"{correction}" is not a supported correction')
+
+    adjusted[valid] = result
+
+    return adjusted
@@ -1,13 +1,24 @@
-import pandas
+from __future__ import annotations
+
 from shiny import reactive, session
 
-import scipy
-import pandas as pd
-import numpy as np
 import re
 import os
+import time
+import logging
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING
 
 from config import Config
+from catalogue import DataCatalogue
+from cache import get_result_cache
+from expectations import freeze_params
+
+# pandas, numpy and scipy are imported inside the functions that need them, so that importing this module (and
+# therefore the app) stays cheap; they are only loaded once a user actually asks for data.
+if TYPE_CHECKING:
+    import pandas as pd
 
 config = Config()
 dist_defaults = config.input_config('distributions')
@@ -15,26 +26,120 @@ dist_defaults = config.input_config('distributions')
 cont_dist = dist_defaults['continuous']
 discrete_dist = dist_defaults['discrete']
 
+logger = logging.getLogger(__name__)
+
+_catalogue: DataCatalogue | None = None
+_catalogue_lock = threading.Lock()
+
+# UI distribution name -> (scipy.stats name, is continuous, default parameters)
+dist_scipy_params = {
+    'Uniform': ('uniform', True, {'loc': dist_defaults['low'], 'scale': dist_defaults['high']}),
+    'Normal': ('norm', True, {'loc': dist_defaults['mean'], 'scale': dist_defaults['sd']}),
+    'Exponential': ('expon', True, {'scale': dist_defaults['scale']}),
+    'Cauchy': ('cauchy', True, {}),
+    'Binomial': ('binom', False, [dist_defaults['trials'], dist_defaults['probability']]),
+    'Geometric': ('geom', False, [dist_defaults['probability']]),
+    'Poisson': ('poisson', False, [dist_defaults['events']])
+}
+
 
 # TODO try to implement the distributions as generators
 
-def get_data_files(data_path: str = None) -> list[tuple[str, str]]:
+def get_catalogue() -> DataCatalogue:
     """
-    Return all file names given a path to a folder with data files
-    :param data_path: list of PathLike file names
+    Return the catalogue of the app's data directory, starting it on first use
     :return:
     """
-    data_dir = ''
+    global _catalogue
 
+    with _catalogue_lock:
+        if _catalogue is None:
+            _catalogue = DataCatalogue(os.path.join(os.path.dirname(__file__), 'data'),
+                                       poll_interval=Config.server_config('catalogue_poll_interval'))
+            # Cached headers and frames of modified or removed files are stale
+            _catalogue.on_change(clear_data_caches)
+            _catalogue.start()
+
+    return _catalogue
+
+
+def clear_data_caches(*args):
+    read_data_header.cache_clear()
+
+
+def get_data_files(data_path: str = None) -> list[tuple[str, str]]:
+    """
+    Return all file names given a path to a folder with data files. The app's own data folder is served from the
+    data catalogue instead of being listed on every call.
+    :param data_path: path to a folder with data files, defaults to the app's data folder
+    :return:
+    """
     if data_path is None:
-        data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        return get_catalogue().files()
 
-    file_names = [(file[:-4], os.path.join(data_dir, file)) for file in os.listdir(data_dir) if
-                  os.path.isfile(os.path.join(data_dir, file))]
+    file_names = [(file[:-4], os.path.join(data_path, file)) for file in os.listdir(data_path) if
+                  os.path.isfile(os.path.join(data_path, file))]
 
     return file_names
 
 
+def normalise_column(name: str) -> str:
+    """
+    Normalise a data file column name to lower snake case e.g. 'Life expectancy ' -> 'life_expectancy'
+    :param name: column name as found in the file
+    :return:
+    """
+    return re.sub('[ -]{1,}', '_', name.lower().strip())
+
+
+@lru_cache(maxsize=64)
+def read_data_header(file_path: str) -> dict[str, str]:
+    """
+    Read only the header of a data file. This is the first loading phase: it is enough to populate the group by and
+    aggregator inputs without parsing any data.
+    :param file_path: path to a CSV data file
+    :return: mapping of normalised column names to the names found in the file
+    """
+    import pandas as pd
+
+    return {normalise_column(col): col for col in pd.read_csv(file_path, nrows=0).columns}
+
+
+def read_data_columns(file_path: str, columns: tuple[str, ...]) -> pd.DataFrame:
+    """
+    Read only the given columns of a data file. This is the second loading phase: columns that are not summarized or
+    plotted are never parsed, and rows are dropped only if they miss a value in one of the requested columns.
+    Frames are not cached here: the frames a session keeps are held against the memory budget (see `memory`), which
+    can only free them if nothing else holds on to them.
+    :param file_path: path to a CSV data file
+    :param columns: normalised column names, as returned by `read_data_header`
+    :return:
+    """
+    import pandas as pd
+
+    header = read_data_header(file_path)
+    columns = list(dict.fromkeys(columns))
+
+    df = pd.read_csv(file_path, usecols=[header[col] for col in columns])
+    df.columns = [normalise_column(col) for col in df.columns]
+    df = df[columns].dropna()
+
+    return df
+
+
+def data_source_key(file_path: str, columns: tuple[str, ...] | list) -> tuple:
+    """
+    Identify the frame `read_data_columns` returns for a file and columns, for result cache keys: by the file's path,
+    size and modification time, as in the data catalogue, instead of hashing the content of the frame on every use
+    :param file_path: path to a CSV data file
+    :param columns: normalised column names read from the file
+    :return:
+    """
+    stat = os.stat(file_path)
+
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, tuple(dict.fromkeys(columns))
+
+
 def create_summary_df(data_frame: pd.DataFrame, group_by: str, aggregators: tuple[str] | list,
                       functions: list[str] | str, fallback_functions: list[str] | str = None) -> pd.DataFrame:
     """
@@ -48,6 +153,8 @@ def create_summary_df(data_frame: pd.DataFrame, group_by: str, aggregators: tupl
     :param functions: possible functions to apply e.g. [np.sum, 'mean']
     :return:
     """
+    import pandas as pd
+
     # Revert to default values if empty or not provided
     if functions is None or not functions:
         functions = ['min', 'max', 'mean']
@@ -68,6 +175,153 @@ def create_summary_df(data_frame: pd.DataFrame, group_by: str, aggregators: tupl
     return summarized_df
 
 
+def create_approx_summary_df(data_frame: pd.DataFrame, group_by: str, aggregators: tuple[str] | list,
+                             functions: list[str] | str, fallback_functions: list[str] | str = None,
+                             sample_size: int = 10000, random_state: int = None, z: float = 1.96) -> pd.DataFrame:
+    """
+    Approximate version of `create_summary_df` for exploring large files at interactive latency.
+    'mean' and 'median' are estimated from a stratified sample of about `sample_size` rows per group, 'nunique' from
+    a HyperLogLog sketch of every row; groups of at most `sample_size` rows (fewer rows than sketch registers for
+    'nunique') are computed exactly, with an error bound of 0. Each estimate is followed by a `<column>_<function>_err` column holding its
+    error bound at the confidence level given by `z` (95% by default). Any other function, as well as the fallback
+    functions, is computed exactly.
+    :param data_frame: DataFrame to summarize
+    :param group_by: Column to group by
+    :param aggregators: Columns to aggregate by
+    :param functions: functions to apply, see `create_summary_df`
+    :param fallback_functions: functions applied to non-numeric columns, see `create_summary_df`
+    :param sample_size: expected number of sampled rows per group
+    :param random_state: seed of the sampling
+    :param z: standard score of the confidence level of the error bounds
+    :return:
+    """
+    import numpy as np
+    import pandas as pd
+
+    from sketches import stratified_sample, sample_mean, sample_quantile, hyperloglog_nunique
+
+    if functions is None or not functions:
+        functions = ['min', 'max', 'mean']
+    if isinstance(functions, str):
+        functions = [functions]
+
+    if fallback_functions is None or not fallback_functions:
+        fallback_functions = ['count']
+
+    df = data_frame
+    estimated = ['mean', 'median', 'nunique']
+    numeric = [k for k in aggregators if pd.api.types.is_numeric_dtype(df[k])]
+
+    # Exact part: cheap reductions and non-numeric columns
+    aggs = {k: [f for f in functions if f not in estimated] if k in numeric else fallback_functions
+            for k in aggregators}
+    aggs = {k: v for k, v in aggs.items() if v}
+
+    # The group column is factorised once, the exact reductions group by its integer codes
+    codes, groups = pd.factorize(df[group_by], sort=True)
+    n_groups = len(groups)
+    population = np.bincount(codes, minlength=n_groups)
+    index = pd.Index(groups, name=group_by)
+
+    if aggs:
+        summarized_df = df[list(aggs)].groupby(codes).agg(aggs).set_axis(index)
+        summarized_df.columns = ['_'.join(col) for col in summarized_df.columns.values]
+    else:
+        summarized_df = pd.DataFrame(index=index)
+
+    sample = stratified_sample(codes, sample_size, random_state, population)
+
+    for k in numeric:
+        for function in [f for f in functions if f in estimated]:
+            if function == 'nunique':
+                hashes = pd.util.hash_pandas_object(df[k], index=False).to_numpy()
+                estimate, error = hyperloglog_nunique(hashes, codes, n_groups, z=z)
+            else:
+                values = df[k].to_numpy(dtype=np.float64)[sample]
+                if function == 'mean':
+                    estimate, error = sample_mean(values, codes[sample], n_groups, population, z)
+                else:
+                    estimate, error = sample_quantile(values, codes[sample], n_groups, population, 0.5, z)
+
+            summarized_df[f'{k}_{function}'] = estimate
+            summarized_df[f'{k}_{function}_err'] = error
+
+    # Same column order as create_summary_df, with every error bound right after its estimate
+    order = [f'{k}_{f}' for k in aggregators for f in (functions if k in numeric else fallback_functions)]
+    order = [c for col in order for c in (col, f'{col}_err') if c in summarized_df.columns]
+
+    return summarized_df[order].reset_index()
+
+
+def create_window_df(data_frame: pd.DataFrame, group_by: str, time_col: str, aggregators: tuple[str] | list,
+                     functions: list[str] | str, window: int = None, resample: float = None) -> pd.DataFrame:
+    """
+    Time series version of `create_summary_df`: the frame is grouped by `group_by` and `time_col`, and every numeric
+    column from `aggregators` is summarized over a rolling or expanding window of the periods of each group.
+    The time column must be numeric, e.g. a year. Every period first holds the mean of its rows; with `resample` the
+    time column is cut into longer periods first, e.g. 10 for decades of a year column. Windows count the periods
+    present in the data, a group missing a year does not get an empty period.
+    The result holds `group_by`, `time_col` and the period means, followed by one `<column>_<kind>_<function>` column
+    per function, where kind is 'rolling<window>' or 'expanding'.
+    :param data_frame: DataFrame to summarize
+    :param group_by: Column to group by
+    :param time_col: Column holding the time, numeric e.g. a year, other than `group_by`
+    :param aggregators: Columns to aggregate by, non-numeric columns are left out
+    :param functions: window functions among 'mean', 'min', 'max' and 'sum'
+    :param window: number of periods per window, at least 1, None for expanding windows
+    :param resample: length of the periods, in units of the time column
+    :return:
+    """
+    import pandas as pd
+
+    from windows import group_row_starts, window_sum, window_mean, window_extreme
+
+    if functions is None or not functions:
+        functions = ['mean']
+    if isinstance(functions, str):
+        functions = [functions]
+
+    if time_col == group_by:
+        raise ValueError(f'The time column "{time_col}" is also the column to group by')
+    if window is not None and window < 1:
+        raise ValueError(f'The window must be at least 1 period, got {window}')
+    if window is not None:
+        window = int(window)
+
+    numeric = [k for k in aggregators
+               if k not in (group_by, time_col) and pd.api.types.is_numeric_dtype(data_frame[k])]
+
+    time = data_frame[time_col]
+    if not pd.api.types.is_numeric_dtype(time):
+        raise ValueError(f'The time column "{time_col}" is not numeric')
+    if resample and resample != 1:
+        time = time // resample * resample
+
+    # One row per group and period, sorted by group then time
+    panel = (data_frame[[group_by, *numeric]].assign(**{time_col: time})
+             .groupby([group_by, time_col], sort=True)[numeric].mean().reset_index())
+
+    row_starts = group_row_starts(pd.factorize(panel[group_by])[0])
+    kind = 'expanding' if window is None else f'rolling{window}'
+
+    windowed = {}
+    for k in numeric:
+        values = panel[k].to_numpy(dtype='float64')
+        for function in functions:
+            if function == 'mean':
+                result = window_mean(values, row_starts, window)
+            elif function == 'sum':
+                result = window_sum(values, row_starts, window)[0]
+            elif function in ['min', 'max']:
+                result = window_extreme(values, row_starts, window, function)
+            else:
+                raise ValueError(f'"{function}" is not a supported window function')
+
+            windowed[f'{k}_{kind}_{function}'] = result
+
+    return pd.concat([panel, pd.DataFrame(windowed, index=panel.index)], axis=1)
+
+
 def create_distribution_df(dist_name: str, continuous_dist: bool, dist_size: int, user_options: tuple,
                            conditional: reactive.Value,dist_params: [list | dict],
                            stat_moments: str = 'mvsk', random_state: int = None):
@@ -81,14 +335,29 @@ def create_distribution_df(dist_name: str, continuous_dist: bool, dist_size: int
     :param conditional: Conditional argument for extra options to generate
     :param dist_params: Distribution parameters: scale, loc, trials etc.
     :param stat_moments: 'Mean, Variance, Skewness, Kurtosis' - mvsk
-    :return:
+    :return: distribution array, data frame, stats and the (scipy name, frozen parameters) of the distribution
     """
     # TODO make this work with any type of given moments. Only works with 'mvsk' at the moment
+    import numpy as np
+    import pandas as pd
+    import scipy.stats
+
+    # Seeded distributions are reproducible, so they are served from the persistent result cache
+    cache, cache_key = None, None
+    if random_state is not None:
+        cache = get_result_cache()
+        cache_key = cache.key('distribution', dist_name, continuous_dist, dist_size,
+                              [option() for option in user_options], bool(conditional()), dist_params, stat_moments,
+                              random_state)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     dist_data = {
         'distribution_array': None,
         'distribution_df': None,
-        'stats': None
+        'stats': None,
+        'parameters': (dist_name, freeze_params(dist_params))
     }
     dist = None
     standard_cols = cont_dist['standard'] if continuous_dist else discrete_dist['standard']
@@ -123,7 +392,7 @@ def create_distribution_df(dist_name: str, continuous_dist: bool, dist_size: int
     else:
         dist_array = np.vstack((dist_rvs, pdf_pmf, cdf, calc_user_option))
 
-    dist_df = pandas.DataFrame(dist_array.T)
+    dist_df = pd.DataFrame(dist_array.T)
 
     if conditional():
         dist_df.columns = [*standard_cols, user_options[0](), user_options[1]()]
@@ -135,9 +404,68 @@ def create_distribution_df(dist_name: str, continuous_dist: bool, dist_size: int
     dist_data['stats'] = {k: round(v, 4) for k, v in
                           zip(['mean', 'variance', 'skewness', 'kurtosis', 'entropy', 'loc', 'scale'], stats)}
 
+    if cache is not None:
+        cache.set(cache_key, dist_data)
+
     return dist_data
 
 
+def warm_up():
+    """
+    Pay the one-off start-up costs before the first user does: read the header of every data file into the cache,
+    generate each configured distribution once (which triggers scipy's lazy submodule imports) and build a throwaway
+    Plotly figure.
+    :return:
+    """
+    start = time.perf_counter()
+
+    for name, file_path in get_data_files():
+        try:
+            read_data_header(file_path)
+        except Exception:
+            logger.exception('Warm-up could not load data file "%s"', name)
+
+    for name in cont_dist['names'] + discrete_dist['names']:
+        scipy_name, continuous, params = dist_scipy_params[name]
+        methods = cont_dist['methods'] if continuous else discrete_dist['methods']
+        extra_methods = cont_dist['extra_methods'] if continuous else discrete_dist['extra_methods']
+
+        try:
+            create_distribution_df(scipy_name, continuous, 10, (lambda: methods[0], lambda: extra_methods[0]),
+                                   lambda: True, params)
+        except Exception:
+            logger.exception('Warm-up could not create the "%s" distribution', name)
+
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+
+    # shinywidgets only allows FigureWidgets inside a session, so the figure is serialised instead
+    fig = make_subplots(rows=1, cols=2)
+    fig.add_trace(go.Histogram(x=[0, 1, 1]), 1, 1)
+    fig.add_trace(go.Scatter(x=[0, 1], y=[0, 1], mode='markers'), 1, 2)
+    fig.to_json()
+
+    logger.info('Warm-up finished in %.2f seconds', time.perf_counter() - start)
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    Run `warm_up` in a daemon thread so that it never delays the app from serving requests.
+    :return:
+    """
+    # The app does not configure logging, and the root logger's default level (WARNING) would hide the warm-up time
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(levelname)s:     %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+
+    return thread
+
+
 # This is a hacky workaround to help Plotly plots automatically
 # resize to fit their container. In the future we'll have a
 # built-in solution for this.
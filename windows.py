@@ -0,0 +1,120 @@
+"""
+Rolling and expanding window aggregations used by the time series mode of the summarizer. Like the estimators in
+`sketches`, every function works on all groups at once: values are a flat array sorted by group and time, and
+`row_starts` holds, for every row, the position of the first row of its group. No window is ever recomputed from
+scratch, every step costs O(1):
+
+* sums, counts and means are differences of prefix sums, sum[i] = S[i] - S[lo - 1];
+* minima and maxima use the van Herk / Gil-Werman algorithm: each group is cut into blocks of `window` rows, and a
+  window, which spans at most two blocks, is the extreme of a suffix scan of the first block and a prefix scan of the
+  second.
+
+`window=None` gives expanding windows, from the first row of the group. Missing values (NaN) are skipped; a window
+without any value gives NaN, as with pandas' `rolling(window, min_periods=1)`.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def group_row_starts(group_codes: np.ndarray) -> np.ndarray:
+    """
+    Position of the first row of its group, for every row
+    :param group_codes: group code of every row, rows of a group being contiguous
+    :return:
+    """
+    import numpy as np
+
+    starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+
+    return np.repeat(starts, np.diff(np.r_[starts, len(group_codes)]))
+
+
+def _window_starts(row_starts: np.ndarray, window: int | None) -> np.ndarray:
+    import numpy as np
+
+    if window is None:
+        return row_starts
+
+    return np.maximum(np.arange(len(row_starts)) - window + 1, row_starts)
+
+
+def window_sum(values: np.ndarray, row_starts: np.ndarray, window: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sum and number of values of every window
+    :param values: values sorted by group and time
+    :param row_starts: see `group_row_starts`
+    :param window: number of rows per window, None for expanding windows
+    :return: (sums, counts)
+    """
+    import numpy as np
+
+    present = ~np.isnan(values)
+    prefix_sum = np.r_[0, np.cumsum(np.where(present, values, 0))]
+    prefix_count = np.r_[0, np.cumsum(present)]
+
+    ends = np.arange(1, len(values) + 1)
+    starts = _window_starts(row_starts, window)
+    counts = prefix_count[ends] - prefix_count[starts]
+
+    return np.where(counts > 0, prefix_sum[ends] - prefix_sum[starts], np.nan), counts
+
+
+def window_mean(values: np.ndarray, row_starts: np.ndarray, window: int = None) -> np.ndarray:
+    """
+    Mean of every window
+    :param values: values sorted by group and time
+    :param row_starts: see `group_row_starts`
+    :param window: number of rows per window, None for expanding windows
+    :return:
+    """
+    import numpy as np
+
+    sums, counts = window_sum(values, row_starts, window)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def _segmented_scan(values: np.ndarray, segments: np.ndarray, how: str) -> np.ndarray:
+    import pandas as pd
+
+    return getattr(pd.Series(values).groupby(segments, sort=False), how)().to_numpy()
+
+
+def window_extreme(values: np.ndarray, row_starts: np.ndarray, window: int = None, how: str = 'max') -> np.ndarray:
+    """
+    Maximum or minimum of every window
+    :param values: values sorted by group and time
+    :param row_starts: see `group_row_starts`
+    :param window: number of rows per window, None for expanding windows
+    :param how: 'max' or 'min'
+    :return:
+    """
+    import numpy as np
+
+    if how not in ['max', 'min']:
+        raise ValueError(f'"{how}" is not a supported window extreme')
+
+    fill, combine, scan = (-np.inf, np.maximum, 'cummax') if how == 'max' else (np.inf, np.minimum, 'cummin')
+    values = np.where(np.isnan(values), fill, values)
+
+    if window is None:
+        result = _segmented_scan(values, row_starts, scan)
+    else:
+        rows = np.arange(len(values))
+        # Blocks of `window` rows, aligned with the first row of every group
+        blocks = row_starts + (rows - row_starts) // window * window
+        prefix = _segmented_scan(values, blocks, scan)
+        suffix = _segmented_scan(values[::-1], blocks[::-1], scan)[::-1]
+
+        result = prefix.copy()
+        first = rows - window + 1
+        # Windows cut short by the start of the group lie within its first block, where the prefix scan is exact
+        full = first >= row_starts
+        result[full] = combine(suffix[first[full]], prefix[full])
+
+    return np.where(result == fill, np.nan, result)